@@ -2,7 +2,10 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 from datetime import datetime
-from utils import load_expenses, get_latest_active_month, format_currency, apply_custom_css, COLORS, get_connection_status
+from utils import (
+    load_monthly_summary, load_yearly_summary, get_latest_active_month_from_summary,
+    format_currency, apply_custom_css, COLORS, get_connection_status
+)
 
 # Page Config
 st.set_page_config(page_title="סיכומים", page_icon="📊", layout="wide")
@@ -10,20 +13,15 @@ st.set_page_config(page_title="סיכומים", page_icon="📊", layout="wide")
 # Apply Global CSS
 apply_custom_css()
 
-# Load Data
-df = load_expenses()
-
-# Helper for date sorting
-if not df.empty and 'תאריך רכישה' in df.columns:
-    df['date_dt'] = pd.to_datetime(df['תאריך רכישה'], errors='coerce')
-    df['year'] = df['date_dt'].dt.year
-    df['month_dt'] = df['date_dt'].dt.to_period('M')
+# Load Data (server-side aggregates: one row per month/year x category)
+monthly = load_monthly_summary()
+yearly = load_yearly_summary()
 
 # Header
 st.title("📊 סיכומים")
 st.caption("מבט על ההוצאות והמגמות שלך")
 
-if df.empty:
+if monthly.empty:
     st.info("אין נתונים להצגה. אנא עבור לדף ההגדרות והעלה קובץ נתונים.")
     # Show connection diagnostics
     status = get_connection_status()
@@ -39,17 +37,18 @@ else:
     # TOP METRICS (Averages and Totals)
     # ---------------------------------------------------------
     # Determine "Current" Month (Smart Logic)
-    active_month = get_latest_active_month(df)
+    active_month = get_latest_active_month_from_summary(monthly)
     
     # Filter last 12 months based on REAL time, or based on ACTIVE month?
     # Usually "Last 12 months" means "Historical context".
     # Let's keep 12 months from NOW for the trend, but highlight the ACTIVE month in metrics.
+    # Aggregates are per calendar month: the current month and the 11 before it.
     
     now = datetime.now()
-    # Ensure correct type for filtering
-    last_12_months = df[df['date_dt'] >= (pd.Timestamp(now) - pd.DateOffset(months=12))]
+    last_12_months = monthly[monthly['month_start'] > (pd.Timestamp(now) - pd.DateOffset(months=12))]
+    active_month_rows = monthly[monthly['month_start'].dt.strftime('%m/%Y') == active_month]
     
-    total_spend_12m = last_12_months['סכום עסקה'].sum()
+    total_spend_12m = last_12_months['total'].sum()
     avg_monthly_spend = total_spend_12m / 12  # Simple avg
     
     col1, col2, col3, col4 = st.columns(4)
@@ -59,7 +58,7 @@ else:
     with col2:
         st.metric("ממוצע חודשי", format_currency(avg_monthly_spend))
     with col3:
-        curr_month_spend = df[df['חודש'] == active_month]['סכום עסקה'].sum()
+        curr_month_spend = active_month_rows['total'].sum()
         st.metric(f"חודש פעיל ({active_month})", format_currency(curr_month_spend))
     with col4:
         # Widget: Current Month vs Monthly Average
@@ -70,8 +69,7 @@ else:
              avg_monthly = 0
 
         # Calculate Current Month Spend
-        current_month_data = df[df['חודש'] == active_month]
-        current_spend = current_month_data['סכום עסקה'].sum() if not current_month_data.empty else 0
+        current_spend = active_month_rows['total'].sum() if not active_month_rows.empty else 0
         
         # Calculate Delta (Percentage or Amount)
         delta_val = current_spend - avg_monthly
@@ -93,12 +91,12 @@ else:
     
     if not last_12_months.empty:
         # Monthly totals
-        monthly_total = last_12_months.groupby(last_12_months['date_dt'].dt.strftime('%Y-%m'))['סכום עסקה'].sum().reset_index()
+        monthly_total = last_12_months.groupby(last_12_months['month_start'].dt.strftime('%Y-%m'))['total'].sum().reset_index()
         monthly_total.columns = ['Month', 'Amount']
         monthly_total['Type'] = 'סה"כ'
         
         # Category totals per month
-        monthly_cat = last_12_months.groupby([last_12_months['date_dt'].dt.strftime('%Y-%m'), 'קטגוריה'])['סכום עסקה'].sum().reset_index()
+        monthly_cat = last_12_months.groupby([last_12_months['month_start'].dt.strftime('%Y-%m'), 'קטגוריה'])['total'].sum().reset_index()
         monthly_cat.columns = ['Month', 'Category', 'Amount']
         
         # Base Chart
@@ -147,7 +145,9 @@ else:
     with row2_col1:
         st.markdown("### ממוצעים לקטגוריה")
         if not last_12_months.empty:
-            avg_per_cat = last_12_months.groupby('קטגוריה')['סכום עסקה'].mean().reset_index()
+            # Average per transaction = total / number of transactions
+            avg_per_cat = last_12_months.groupby('קטגוריה')[['total', 'count']].sum()
+            avg_per_cat = (avg_per_cat['total'] / avg_per_cat['count']).rename('סכום עסקה').reset_index()
             avg_per_cat = avg_per_cat.sort_values('סכום עסקה', ascending=False)
             
             st.dataframe(
@@ -164,17 +164,17 @@ else:
     with row2_col2:
         st.markdown("### סיכום שנתי לפי קטגוריות")
         
-        years = sorted(df['year'].dropna().unique(), reverse=True)
+        years = sorted(yearly['year'].dropna().unique(), reverse=True)
         # Exclude current year if requested? User said "Yearly Summary: Change Avg/Txn to Monthly Average (Total / 12)"
         # Showing all years is fine, but the metric should be Monthly Average.
         
         if years:
             selected_year = st.selectbox("בחר שנה להצגה", [int(y) for y in years], index=0)
             
-            year_data = df[df['year'] == selected_year]
+            year_data = yearly[yearly['year'] == selected_year]
             
-            # Group by Category
-            cat_summary = year_data.groupby('קטגוריה')['סכום עסקה'].agg(['sum', 'count']).reset_index()
+            # Already grouped by Category on the server
+            cat_summary = year_data[['קטגוריה', 'total', 'count']].copy()
             cat_summary.columns = ['קטגוריה', 'סה"כ', 'מס׳ עסקאות']
             
             # Calculate Monthly Average (Total / 12)
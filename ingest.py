@@ -0,0 +1,297 @@
+"""
+Bank / card statement parsing (CSV and Excel uploads), shared by the app
+(utils.py) and the upload worker processes. Has no Streamlit dependency so
+process-pool workers can import it cheaply.
+
+A statement has one or more sections, each under its own header row.
+"""
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from supabase_io import EXPENSE_COLUMNS as COLUMNS
+
+
+class StatementError(ValueError):
+    """An upload that cannot be read; the message is shown to the user."""
+
+
+# ============================================
+# STATEMENT PARSING
+# ============================================
+KNOWN_DATE_COLS = ['תאריך רכישה', 'תאריך', 'תאריך עסקה']
+KNOWN_NAME_COLS = ['שם בית עסק', 'שם בית העסק', 'עסק', 'שם העסק']
+KNOWN_AMOUNT_COLS = ['סכום חיוב', 'סכום עסקה', 'סכום', 'סכום מקורי']
+SUMMARY_PATTERNS = ['TOTAL FOR DATE', 'סך חיוב', 'סה"כ', 'סהכ', 'total']
+SUMMARY_RE = re.compile('|'.join(re.escape(p) for p in SUMMARY_PATTERNS), re.IGNORECASE)
+
+# Tried in this order per value; a section's format is inferred once from a sample
+DATE_FORMATS = [
+    '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y',
+    '%Y-%m-%d', '%d/%m/%y', '%d-%m-%y',
+    '%Y-%m-%d %H:%M:%S',   # date cells of an Excel sheet, stringified
+]
+DATE_SAMPLE_SIZE = 200
+UPLOAD_CHUNK_ROWS = 20000   # CSV lines per streamed batch
+
+def _cell_text(col):
+    """Column-wise `str(val).strip()`, with '' for missing / 'nan' cells."""
+    text = col.astype(object).where(col.notna(), '').astype(str).str.strip()
+    return text.mask(text == 'nan', '')
+
+def _parse_date_value(date_str):
+    """Parse one date string (slow path for values the section format missed)."""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    try:
+        return pd.to_datetime(date_str, dayfirst=True)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+def _infer_date_format(text):
+    """The format that parses most of a sample of `text` (None if none does)."""
+    sample = text.head(DATE_SAMPLE_SIZE)
+    best, best_hits = None, 0
+    for fmt in DATE_FORMATS:
+        hits = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+    return best
+
+def _parse_dates(text):
+    """Column-wise date parsing: one to_datetime call with the inferred format,
+    then `_parse_date_value` for the leftovers only. NaT when unparsable."""
+    fmt = _infer_date_format(text)
+    if fmt is None:
+        parsed = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+    else:
+        parsed = pd.to_datetime(text, format=fmt, errors='coerce')
+    leftover = parsed.isna()
+    if leftover.any():
+        parsed[leftover] = pd.to_datetime(text[leftover].map(_parse_date_value), errors='coerce')
+    return parsed
+
+def _find_header_sections(df_raw):
+    """Rows holding a date header plus a business and/or amount header.
+
+    Returns [{'row', 'date_col', 'name_col', 'amount_col'}] with positional
+    column indexes (the last matching cell wins, None when absent).
+    """
+    masks = {'date_col': [], 'name_col': [], 'amount_col': []}
+    known = {'date_col': KNOWN_DATE_COLS, 'name_col': KNOWN_NAME_COLS, 'amount_col': KNOWN_AMOUNT_COLS}
+    for col_idx in range(df_raw.shape[1]):
+        col = df_raw.iloc[:, col_idx]
+        # Only text cells can be a header; numeric columns never match. Object
+        # columns may hold no strings at all (times, booleans) - stringify first
+        text = _cell_text(col) if col.dtype == object or pd.api.types.is_string_dtype(col) else None
+        for key, names in known.items():
+            masks[key].append(text.isin(names).to_numpy() if text is not None else np.zeros(len(col), bool))
+    hits = {key: np.column_stack(cols) if cols else np.zeros((len(df_raw), 0), bool) for key, cols in masks.items()}
+    is_header = hits['date_col'].any(axis=1) & (hits['name_col'].any(axis=1) | hits['amount_col'].any(axis=1))
+
+    sections = []
+    for row_idx in np.flatnonzero(is_header):
+        section = {'row': int(row_idx)}
+        for key, hit in hits.items():
+            found = np.flatnonzero(hit[row_idx])
+            section[key] = int(found[-1]) if len(found) else None
+        sections.append(section)
+    return sections
+
+def _extract_sections(df_raw, open_section=None):
+    """Expense rows of every header section in `df_raw`.
+
+    `open_section` is a section whose header came before `df_raw` (streamed
+    chunks); rows up to the first header of `df_raw` belong to it. Returns
+    (COLUMNS frame or None if nothing was found, the section still open).
+    """
+    header_sections = _find_header_sections(df_raw)
+    if open_section is not None:
+        header_sections.insert(0, {**open_section, 'row': -1})
+    sections = [
+        _extract_section(df_raw, section, header_sections[i + 1]['row'] if i + 1 < len(header_sections) else len(df_raw))
+        for i, section in enumerate(header_sections)
+    ]
+    sections = [section for section in sections if not section.empty]
+    normalized = pd.concat(sections, ignore_index=True)[COLUMNS] if sections else None
+    return normalized, (header_sections[-1] if header_sections else None)
+
+def _extract_section(df_raw, section, end_row):
+    """Expense rows between a header row and `end_row`, as a COLUMNS frame.
+
+    Rows without a date or business, summary rows and rows whose amount is
+    missing, unparsable or zero are dropped. Dates are parsed here, so each
+    section gets its own inferred format.
+    """
+    if section['name_col'] is None or section['amount_col'] is None:
+        return pd.DataFrame(columns=COLUMNS)
+    block = df_raw.iloc[section['row'] + 1:end_row]
+    dates = _cell_text(block.iloc[:, section['date_col']])
+    names = _cell_text(block.iloc[:, section['name_col']])
+    amounts = pd.to_numeric(block.iloc[:, section['amount_col']], errors='coerce')
+
+    keep = (
+        (dates != '') & (names != '')
+        & ~names.str.contains(SUMMARY_RE)
+        & amounts.notna() & (amounts != 0)
+    )
+    parsed = _parse_dates(dates[keep])
+    return pd.DataFrame({
+        'תאריך רכישה': parsed.dt.strftime('%Y-%m-%d').fillna(''),
+        'שם בית עסק': names[keep],
+        'סכום עסקה': amounts[keep].astype(float),
+        'חודש': parsed.dt.strftime('%m/%Y').fillna(''),
+        'קטגוריה': '',
+        'הערות': '',
+    })
+
+
+def normalize_statement(uploaded_file, sheet_workers=1) -> pd.DataFrame:
+    """Read and normalize an uploaded statement into a COLUMNS frame.
+
+    `uploaded_file` is a file-like object with a `.name` (Streamlit upload or
+    BytesIO). Every sheet of an Excel workbook is read, `sheet_workers` at a
+    time. Raises StatementError for unsupported or unreadable files.
+    """
+    batches = list(iter_statement_batches(uploaded_file, sheet_workers))
+    return pd.concat(batches, ignore_index=True) if batches else pd.DataFrame(columns=COLUMNS)
+
+
+def iter_statement_csv(uploaded_file, chunk_rows=UPLOAD_CHUNK_ROWS):
+    """Stream a CSV statement as normalized batches (COLUMNS frames).
+
+    The file is read `chunk_rows` lines at a time; the header section that is
+    open at the end of a chunk carries over to the rows of the next one, so
+    memory stays flat however long the statement is. Cells are read as text
+    so every chunk is typed the same way.
+    """
+    uploaded_file.seek(0)
+    try:
+        reader = pd.read_csv(uploaded_file, encoding='utf-8-sig', header=None, dtype=str, chunksize=chunk_rows)
+        open_section = None
+        with reader:
+            for chunk in reader:
+                batch, open_section = _extract_sections(chunk.reset_index(drop=True), open_section)
+                if batch is not None:
+                    yield batch
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        raise StatementError(f"שגיאה בקריאת קובץ CSV: {str(e)}") from e
+
+
+def iter_statement_batches(uploaded_file, sheet_workers=1):
+    """Normalized batches of a statement: CSV chunks, or one batch per Excel sheet.
+
+    Any failure is raised as StatementError, so callers can report it per file.
+    """
+    filename = uploaded_file.name.lower()
+    if not filename.endswith(('.csv', '.xlsx', '.xls')):
+        raise StatementError("סוג קובץ לא נתמך. אנא העלה קובץ CSV או Excel.")
+    try:
+        if filename.endswith('.csv'):
+            yield from iter_statement_csv(uploaded_file)
+        else:
+            uploaded_file.seek(0)
+            for batch in _excel_sheet_batches(uploaded_file.read(), sheet_workers):
+                if batch is not None:
+                    yield batch
+    except StatementError:
+        raise
+    except Exception as e:
+        raise StatementError(f"שגיאה בעיבוד הקובץ: {e}") from e
+
+
+# ============================================
+# EXCEL WORKBOOKS
+# (issuers may put each card or month on its own sheet - all sheets are read)
+# ============================================
+def _open_workbook(data):
+    # read_only streams rows from the sheet XML instead of building every cell object
+    return openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+
+
+def parse_xlsx_sheet(data, sheet_name):
+    """Process-pool worker: normalized rows of one .xlsx sheet (None if none)."""
+    workbook = _open_workbook(data)
+    try:
+        sheet = workbook[sheet_name]
+        # Some exporters write a wrong <dimension>; iterate the rows actually present
+        sheet.reset_dimensions()
+        df_raw = pd.DataFrame(sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+    normalized, _ = _extract_sections(df_raw)
+    return normalized
+
+
+def _excel_sheet_batches(data, sheet_workers=1):
+    """Normalized rows of every sheet, in sheet order (None for sheets without any)."""
+    try:
+        workbook = _open_workbook(data)
+        sheet_names = workbook.sheetnames
+        workbook.close()
+    except Exception:
+        # Legacy .xls (or a misnamed file) - xlrd reads all sheets at once
+        try:
+            sheets = pd.read_excel(io.BytesIO(data), engine='xlrd', header=None, sheet_name=None)
+        except Exception as e:
+            raise StatementError(f"שגיאה בקריאת קובץ Excel: {str(e)}") from e
+        return [_extract_sections(df_raw)[0] for df_raw in sheets.values()]
+    return _map_in_processes(parse_xlsx_sheet, [(data, name) for name in sheet_names], sheet_workers)
+
+
+# ============================================
+# PARALLEL PARSING (PROCESS POOL)
+# ============================================
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+
+def _map_in_processes(fn, arg_lists, max_workers):
+    """`[fn(*args) for args in arg_lists]`, on a process pool when there is more than one job.
+
+    Parsing is pure Python / pandas work that holds the GIL, so threads would
+    not help. An environment that cannot start processes runs the jobs in-process.
+    """
+    if len(arg_lists) < 2 or max_workers < 2:
+        return [fn(*args) for args in arg_lists]
+    try:
+        # spawn, not fork: the Streamlit server is multi-threaded
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(arg_lists)), mp_context=context) as pool:
+            return list(pool.map(fn, *zip(*arg_lists)))
+    except (OSError, BrokenProcessPool) as e:
+        print(f"[WARN] Parsing uploads in-process, worker pool unavailable: {e}")
+        return [fn(*args) for args in arg_lists]
+
+
+def parse_statement_bytes(name, data, sheet_workers=1):
+    """Process-pool worker: parse one file's bytes. Returns {name, rows, error}."""
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    try:
+        return {'name': name, 'rows': normalize_statement(buffer, sheet_workers), 'error': None}
+    except StatementError as e:
+        return {'name': name, 'rows': None, 'error': str(e)}
+    except Exception as e:
+        return {'name': name, 'rows': None, 'error': f"שגיאה בעיבוד הקובץ: {e}"}
+
+
+def parse_statements(files, max_workers=PARSE_WORKERS):
+    """Parse several statements in parallel; `files` is a list of (name, bytes).
+
+    Returns one {name, rows, error} dict per file, in input order. Files are
+    spread over worker processes; a single file gets the workers for its sheets.
+    """
+    if len(files) == 1:
+        name, data = files[0]
+        return [parse_statement_bytes(name, data, max_workers)]
+    return _map_in_processes(parse_statement_bytes, files, max_workers)
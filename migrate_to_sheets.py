@@ -18,7 +18,7 @@ def migrate():
     try:
         local_df = db._load_local_expenses()
         if not local_df.empty:
-            db.save_expenses(local_df)
+            db.rebuild_expenses(local_df)
             print(f"✅ Uploaded {len(local_df)} expenses.")
         else:
             print("⚠️ Local expenses file is empty or missing.")
@@ -4,6 +4,8 @@ import json
 import os
 from supabase import create_client
 
+from supabase_io import expense_records
+
 # Constants
 EXPENSES_FILE = "expenses.csv"
 CATEGORIES_FILE = "categories.json"
@@ -45,26 +47,8 @@ def migrate():
             # DB: date, business, amount, category, notes, month
             # CSV: 'תאריך רכישה', 'שם בית עסק', 'סכום עסקה', 'קטגוריה', 'הערות', 'חודש'
             
-            records = []
-            for _, row in df.iterrows():
-                # Handle potential missing cols gracefully
-                date = str(row.get('תאריך רכישה', ''))
-                business = str(row.get('שם בית עסק', ''))
-                amount_val = row.get('סכום עסקה', 0)
-                amount = float(amount_val) if amount_val else 0.0
-                category = str(row.get('קטגוריה', ''))
-                notes = str(row.get('הערות', ''))
-                month = str(row.get('חודש', ''))
-                
-                records.append({
-                    'date': date,
-                    'business': business,
-                    'amount': amount,
-                    'category': category,
-                    'notes': notes,
-                    'month': month
-                })
-            
+            records = expense_records(df)
+
             if records:
                 # Sync: Delete all & Insert
                 client.table('expenses').delete().neq('id', 0).execute()
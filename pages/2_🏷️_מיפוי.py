@@ -1,16 +1,17 @@
 import streamlit as st
 import pandas as pd
-from utils import load_expenses, save_expenses, apply_custom_css, load_categories, format_currency, load_mapping, save_mapping
+from utils import (
+    load_all, update_expense_category, classify_business, upsert_mapping_rule,
+    apply_custom_css, format_currency, UNCATEGORIZED_FILTER
+)
 
 st.set_page_config(page_title="מיפוי מהיר", page_icon="🏷️", layout="wide")
 apply_custom_css()
 
 st.title("🏷️ מיפוי מהיר")
 
-df = load_expenses()
-
-# Filter empty categories
-to_map = df[(df['קטגוריה'].isna()) | (df['קטגוריה'] == '') | (df['קטגוריה'] == 'nan')]
+# Only uncategorized expenses are needed here (all three datasets load concurrently)
+to_map, categories, _ = load_all(where=UNCATEGORIZED_FILTER)
 
 if to_map.empty:
     st.success("🎉 כל ההוצאות מסווגות!")
@@ -20,6 +21,15 @@ if to_map.empty:
         except:
             st.switch_page("Home.py") 
 else:
+    # Queue = one card per business (most frequent first), not one per expense
+    to_map['business_key'] = to_map['שם בית עסק'].astype(str).str.strip()
+    queue = to_map.groupby('business_key', sort=False).agg(
+        count=('סכום עסקה', 'size'),
+        total=('סכום עסקה', 'sum'),
+        first_date=('תאריך רכישה', 'min'),
+        last_date=('תאריך רכישה', 'max'),
+    ).sort_values('count', ascending=False, kind='stable')
+    
     # State management for index
     if 'mapping_index' not in st.session_state:
         st.session_state['mapping_index'] = 0
@@ -27,11 +37,12 @@ else:
     current_idx = st.session_state['mapping_index']
     
     # Boundary check
-    if current_idx >= len(to_map):
+    if current_idx >= len(queue):
         st.session_state['mapping_index'] = 0
         current_idx = 0
         
-    row = to_map.iloc[current_idx]
+    business = queue.index[current_idx]
+    group = queue.iloc[current_idx]
     
     # SPLIT LAYOUT: Right (Details) | Left (Buttons)
     # Streamlit columns are LTR. So col1 is Left, col2 is Right.
@@ -48,11 +59,18 @@ else:
     
     with c_right:
         # Details Block
-        st.info("פרטי עסקה")
-        st.markdown(f"**תאריך:** {row['תאריך רכישה']}")
+        st.info("פרטי עסק")
         st.markdown(f"**עסק:**")
-        st.markdown(f"##### {row['שם בית עסק']}")
-        st.markdown(f"**סכום:** {format_currency(row['סכום עסקה'])}")
+        st.markdown(f"##### {business}")
+        st.markdown(f"**עסקאות לא מסווגות:** {group['count']}")
+        st.markdown(f"**סה\"כ:** {format_currency(group['total'])}")
+        first_date = group['first_date'].strftime('%Y-%m-%d') if pd.notna(group['first_date']) else ''
+        last_date = group['last_date'].strftime('%Y-%m-%d') if pd.notna(group['last_date']) else ''
+        if first_date == last_date:
+            st.markdown(f"**תאריך:** {last_date}")
+        else:
+            st.markdown(f"**תאריכים:** {first_date} - {last_date}")
+        st.caption(f"עוד {len(queue) - 1} עסקים ממתינים ({len(to_map)} עסקאות)")
         
         st.write("")
         st.write("")
@@ -62,26 +80,27 @@ else:
 
     with c_left:
         st.subheader("בחר קטגוריה")
-        categories = sorted(load_categories()) # Alphabetical sort
+        categories = sorted(categories) # Alphabetical sort
         valid_cats = [c for c in categories if c]
         
         # Grid for buttons
         cols = st.columns(4) 
         
         def save_category(cat):
-            # 1. Update Expense
-            original_idx = row.name
-            df.at[original_idx, 'קטגוריה'] = cat
-            save_expenses(df)
+            # 1. Update Expenses - one PATCH for the whole business
+            if group['count'] == 1:
+                # Single expense - PATCH it by id
+                row = to_map[to_map['business_key'] == business].iloc[0]
+                update_expense_category(row['id'], cat)
+                updated = 1
+            else:
+                updated = classify_business(business, cat)
             
-            # 2. Update Mapping (Learn/Overwrite)
-            mapping = load_mapping()
-            business = str(row['שם בית עסק']).strip()
+            # 2. Update Mapping (Learn/Overwrite) - a single upsert
             if business:
-                mapping[business] = cat
-                save_mapping(mapping)
+                upsert_mapping_rule(business, cat)
             
-            st.toast(f"סווג כ-{cat} ונשמר לאינדקס")
+            st.toast(f"{updated} עסקאות סווגו כ-{cat} ונשמר לאינדקס")
             # For "Next", we don't necessarily increment index, because current item disappears from 'to_map' logic
             # 'to_map' is recalculated. The item at 'current_idx' is now the *next* item.
             # So we keep index same? Or if we skipped previously, index might be > 0.
@@ -91,7 +110,7 @@ else:
             # However, if we preserve 'mapping_index' state, and the list shrank, 
             # we effectively move forward.
             # Reset index if unsafe.
-            if st.session_state['mapping_index'] >= len(to_map) - 1:
+            if st.session_state['mapping_index'] >= len(queue) - 1:
                  st.session_state['mapping_index'] = 0
                  
             st.rerun()
@@ -1,82 +1,109 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from utils import load_expenses, save_expenses, apply_custom_css, load_categories, format_currency
+from utils import (
+    query_expenses, save_expense_changes, apply_custom_css, load_categories,
+    load_monthly_summary, in_filter, month_filter, format_currency
+)
+
+ROWS_PER_PAGE = 100
 
 st.set_page_config(page_title="כל ההוצאות", page_icon="📋", layout="wide")
 apply_custom_css()
 
 st.title("📋 כל ההוצאות")
 
-df = load_expenses()
+# Filter options come from the (small) monthly summary, not the full table
+summary = load_monthly_summary()
 
-if df.empty:
-    st.info("אין נתונים.")
-else:
-    # ------------------------------------------------------------
-    # FILTERS & SEARCH
-    # ------------------------------------------------------------
-    with st.expander("🔎 חיפוש וסינון", expanded=False):
-        col1, col2, col3 = st.columns(3)
+# ------------------------------------------------------------
+# FILTERS & SEARCH
+# ------------------------------------------------------------
+with st.expander("🔎 חיפוש וסינון", expanded=False):
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        # Load categories from file to ensure up-to-date list
+        all_categories = load_categories()
+        # Also include any categories present in data but not in list
+        data_cats = summary['קטגוריה'].unique().tolist()
+        # Filter out non-string or empty values to prevent sort errors
+        valid_data_cats = [x for x in data_cats if isinstance(x, str) and x.strip()]
+        combined_cats = sorted(list(set(all_categories + valid_data_cats)))
         
-        with col1:
-            # Load categories from file to ensure up-to-date list
-            all_categories = load_categories()
-            # Also include any categories present in data but not in list
-            data_cats = df['קטגוריה'].unique().tolist()
-            # Filter out non-string or empty values to prevent sort errors
-            valid_data_cats = [x for x in data_cats if isinstance(x, str) and x.strip()]
-            combined_cats = sorted(list(set(all_categories + valid_data_cats)))
-            
-            selected_categories = st.multiselect("סינון לפי קטגוריה", options=combined_cats)
+        selected_categories = st.multiselect("סינון לפי קטגוריה", options=combined_cats)
+        
+    with col2:
+        # Months (latest first) - rows without a valid date are only listed under "all months"
+        months = summary.sort_values('month_start', ascending=False)['month_start'].dt.strftime('%m/%Y').unique().tolist()
+        selected_months = st.multiselect("סינון לפי חודש", options=months)
             
-        with col2:
-            # Months
-            if 'חודש' in df.columns:
-                months = list(df['חודש'].unique())
-                selected_months = st.multiselect("סינון לפי חודש", options=months)
-            else:
-                selected_months = []
-                
-        with col3:
-            name_search = st.text_input("חיפוש חופשי (שם עסק)")
+    with col3:
+        name_search = st.text_input("חיפוש חופשי (שם עסק)")
 
-    # ------------------------------------------------------------
-    # FILTER LOGIC
-    # ------------------------------------------------------------
-    filtered_df = df.copy()
-    
-    # 1. Name Search (contains)
-    if name_search:
-        filtered_df = filtered_df[filtered_df['שם בית עסק'].str.contains(name_search, case=False, na=False)]
+# ------------------------------------------------------------
+# FILTER LOGIC (applied by the server)
+# ------------------------------------------------------------
+where = {}
+
+# 1. Name Search (contains)
+if name_search:
+    where['שם בית עסק'] = f"ilike.*{name_search}*"
+
+# 2. Categories
+if selected_categories:
+    where['קטגוריה'] = in_filter(selected_categories)
     
-    # 2. Categories
-    if selected_categories:
-        filtered_df = filtered_df[filtered_df['קטגוריה'].isin(selected_categories)]
-        
-    # 3. Months
-    if selected_months:
-        filtered_df = filtered_df[filtered_df['חודש'].isin(selected_months)]
+# 3. Months - by date range, the same way the summary groups them
+if selected_months:
+    where.update(month_filter(selected_months))
+
+# Back to the first page whenever the filters change
+filter_key = repr(sorted(where.items()))
+if st.session_state.get('expenses_filter_key') != filter_key:
+    st.session_state['expenses_filter_key'] = filter_key
+    st.session_state['expenses_page'] = 0
 
+page = st.session_state.get('expenses_page', 0)
+page_df, total = query_expenses(where, limit=ROWS_PER_PAGE, offset=page * ROWS_PER_PAGE)
+num_pages = max(1, -(-total // ROWS_PER_PAGE))
+if page >= num_pages:
+    st.session_state['expenses_page'] = page = num_pages - 1
+    page_df, total = query_expenses(where, limit=ROWS_PER_PAGE, offset=page * ROWS_PER_PAGE)
+
+if not total and not where:
+    st.info("אין נתונים.")
+else:
     # ------------------------------------------------------------
-    # SUMMARY
+    # SUMMARY & PAGING
     # ------------------------------------------------------------
-    if not filtered_df.empty:
-        st.caption(f"מציג {len(filtered_df)} רשומות מתוך {len(df)}")
+    if total:
+        first_row = page * ROWS_PER_PAGE + 1
+        st.caption(f"מציג {first_row}-{first_row + len(page_df) - 1} מתוך {total} רשומות")
+
+    nav_prev, nav_label, nav_next = st.columns([1, 2, 1])
+    with nav_prev:
+        if st.button("→ הקודם", disabled=page == 0, use_container_width=True):
+            st.session_state['expenses_page'] = page - 1
+            st.rerun()
+    with nav_label:
+        st.markdown(f"<div style='text-align: center'>עמוד {page + 1} מתוך {num_pages}</div>", unsafe_allow_html=True)
+    with nav_next:
+        if st.button("הבא ←", disabled=page >= num_pages - 1, use_container_width=True):
+            st.session_state['expenses_page'] = page + 1
+            st.rerun()
+
+    filtered_df = page_df.copy()
 
     # ------------------------------------------------------------
     # TABLE PREP & EDIT
     # ------------------------------------------------------------
     
-    # Pre-process for Editor
-    if 'תאריך רכישה' in filtered_df.columns:
-        filtered_df['תאריך רכישה'] = pd.to_datetime(filtered_df['תאריך רכישה'], errors='coerce')
-
-    if 'הערות' in filtered_df.columns:
-        filtered_df['הערות'] = filtered_df['הערות'].fillna('').astype(str)
-        
-    if 'קטגוריה' in filtered_df.columns:
-        filtered_df['קטגוריה'] = filtered_df['קטגוריה'].fillna('').astype(str)
+    # Pre-process for Editor (dates are already datetime64)
+    # Editable text columns must be plain strings - a categorical column only accepts existing values
+    for col in ['קטגוריה', 'שם בית עסק']:
+        if col in filtered_df.columns:
+            filtered_df[col] = filtered_df[col].astype(str)
 
     # Columns to show
     # In RTL mode, Column 0 is on the Right.
@@ -86,8 +113,7 @@ else:
         cols_to_show.append('id')
     
     # Default Sort in Data Editor is manual unless we pre-sort.
-    # We already "Default sort by Date - latest to earliest".
-    filtered_df = filtered_df.sort_values('תאריך רכישה', ascending=False)
+    # The server already sorts by Date - latest to earliest.
     
     # Editable Dataframe
     edited_df = st.data_editor(
@@ -144,73 +170,9 @@ else:
                 if col in edited_df.columns:
                     edited_df[col] = edited_df[col].astype(str).replace('nan', '').replace('None', '')
 
-            # 4. Smart Merge (Using ID)
-            # If we have IDs, we use them. If not (local file legacy), we fall back to indices or append.
-            
-            if 'id' in df.columns and 'id' in edited_df.columns:
-                # A. Identify Deletions
-                # IDs that were in filtered_df but are NOT in edited_df
-                # strictly strictly those that had an ID (not new rows)
-                
-                original_ids = set(filtered_df['id'].dropna().astype(str))
-                current_ids = set(edited_df['id'].dropna().astype(str))
-                
-                deleted_ids = original_ids - current_ids
-                
-                # Remove from Global DF
-                if deleted_ids:
-                    df = df[~df['id'].astype(str).isin(deleted_ids)]
-                
-                # B. Identify Updates
-                # Rows with IDs that exist in both.
-                # We update specific columns in Global DF using set index for speed or simple loop
-                # Just iterate edited_df rows that have an ID
-                
-                # Create a map from ID to row index in Global DF?
-                # or just use loc with boolean mask (slower but safe)
-                
-                # Optimization: Convert DF to dict for updates?
-                # Let's iterate through modified rows only? Streamlit doesn't give us "modified only" easily here without session state tracking.
-                # valid_updates = edited_df[edited_df['id'].isin(original_ids)]
-                # Actually, simpler: 
-                # Since we are saving *everything* to Supabase (Delete All + Insert All),
-                # We mainly need to construct the correct Final DF.
-                # So: 
-                # Final DF = (Global DF - Filtered Rows) + Edited Rows
-                # BUT "Filtered Rows" might be a subset.
-                # So:
-                # 1. Start with Global DF.
-                # 2. Drop ALL rows that were in the "Filtered View" (matching IDs).
-                # 3. Append the "Edited DF" (which contains the remaining + updated + new rows).
-                
-                # IDs involved in the filter (Original)
-                ids_in_filter = filtered_df['id'].dropna()
-                
-                # 1. Remove these ID rows from Global
-                df = df[~df['id'].isin(ids_in_filter)]
-                
-                # 2. Append the NEW state of these rows (from editor)
-                # This handles Updates and Deletions (since deleted ones are missing from editor)
-                # And Additions (rows with NaN ID will be appended too)
-                
-                df = pd.concat([df, edited_df], ignore_index=True)
-                
-            else:
-                 # Fallback for No IDs (legacy) - Risky but best effort
-                 # Replace everything? No, that deletes hidden data.
-                 # Merge by Index (unsafe if sort changed).
-                 # If no IDs, we assume we are just managing the file.
-                 # Let's just blindly append new to old unique?
-                 # No, without IDs and with filters, it's impossible to know what was deleted.
-                 # We will assume "Save Changes" implies "Replace All" if no IDs?
-                 # No, that erases data.
-                 # Generate UUIDs for local? 
-                 # For now, simplistic approach:
-                 st.warning("שים לב: עריכה מתקדמת זמינה רק כאשר מחוברים למסד נתונים (ID חסר).")
-                 # Try to match by index if possible
-                 pass
- 
-            save_expenses(df)
+            # 4. Save only this page's changes (matched by ID):
+            #    rows missing from the editor are deleted, rows without an ID are new
+            save_expense_changes(page_df, edited_df)
             st.success("השינויים נשמרו בהצלחה!")
             st.rerun() 
             
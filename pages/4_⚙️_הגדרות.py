@@ -1,10 +1,10 @@
 import streamlit as st
 import pandas as pd
 from utils import (
-    load_expenses, save_expenses, normalize_uploaded_file, apply_custom_css, 
-    load_categories, save_categories, load_mapping, save_mapping, auto_categorize_expenses
+    load_all, append_expenses, clear_local_expenses, iter_uploaded_batches, parse_uploaded_files,
+    apply_custom_css, apply_expense_schema, expense_keys, load_categories, save_categories, load_mapping,
+    save_mapping, auto_categorize_expenses
 )
-import os
 
 st.set_page_config(page_title="הגדרות", page_icon="⚙️", layout="wide")
 apply_custom_css()
@@ -21,56 +21,80 @@ with tab1:
     st.subheader("העלאת נתונים חדשים")
     st.caption("העלה קבצי אקסל או CSV מהבנק/אשראי. המערכת תסווג אוטומטית לפי ההיסטוריה שלך.")
     
-    uploaded_file = st.file_uploader("בחר קובץ (CSV/Excel)", type=['csv', 'xlsx', 'xls'])
+    uploaded_files = st.file_uploader(
+        "בחר קבצים (CSV/Excel)", type=['csv', 'xlsx', 'xls'], accept_multiple_files=True
+    )
     
-    if uploaded_file:
+    if uploaded_files:
         if st.button("עבד ושמור נתונים", type="primary"):
             with st.spinner("מעבד נתונים..."):
-                existing_df = load_expenses()
-                new_df = normalize_uploaded_file(uploaded_file)
+                existing_df, _, mapping = load_all()
+                # Keys use normalized values, so typed (existing) and raw (new) rows compare equal
+                seen_keys = set(expense_keys(existing_df)) if not existing_df.empty else set()
                 
-                if not new_df.empty:
+                def take_new_rows(batch):
+                    """Categorize a parsed batch and drop rows already stored or seen earlier."""
                     # 1. Auto Categorize using Mapping
-                    mapping = load_mapping()
-                    new_df = auto_categorize_expenses(new_df, mapping)
-                    
+                    batch = auto_categorize_expenses(batch, mapping)
                     # 2. Deduplication Logic
-                    if not existing_df.empty:
-                        def create_key(row):
-                            # Create a unique key for deduplication
-                            d = str(row.get('תאריך רכישה', ''))
-                            n = str(row.get('שם בית עסק', '')).strip()
-                            s = str(row.get('סכום עסקה', ''))
-                            return f"{d}|{n}|{s}"
-                        
-                        existing_keys = set(existing_df.apply(create_key, axis=1))
-                        
-                        # Filter out existing
-                        new_rows = []
-                        duplicates = 0
-                        for _, row in new_df.iterrows():
-                            key = create_key(row)
-                            if key not in existing_keys:
-                                new_rows.append(row)
-                                existing_keys.add(key)
-                            else:
-                                duplicates += 1
-                        
-                        if new_rows:
-                            final_new_df = pd.DataFrame(new_rows)
-                            combined_df = pd.concat([existing_df, final_new_df], ignore_index=True)
-                            save_expenses(combined_df)
-                            st.success(f"✅ נוספו {len(new_rows)} רשומות חדשות! ({duplicates} כפילויות סוננו)")
-                            st.info("💡 המערכת סיווגה אוטומטית הוצאות מוכרות. עבור לדף 'מיפוי' כדי לסווג את השאר.")
-                        else:
-                            st.warning(f"⚠️ כל הרשומות בקובץ קיימות כבר במערכת ({duplicates} כפילויות).")
-                    else:
-                        save_expenses(new_df)
-                        st.success(f"✅ נוספו {len(new_df)} רשומות חדשות!")
-                        st.info("💡 המערכת סיווגה אוטומטית הוצאות מוכרות.")
-                        
+                    batch_keys = expense_keys(batch)
+                    is_new = ~batch_keys.isin(seen_keys) & ~batch_keys.duplicated()
+                    seen_keys.update(batch_keys[is_new])
+                    return batch[is_new], int((~is_new).sum())
+                
+                summary = []
+                if len(uploaded_files) == 1:
+                    # One file: CSV arrives in batches, each saved before the next is read
+                    stats = {'קובץ': uploaded_files[0].name, 'שורות': 0, 'חדשות': 0, 'כפילויות': 0, 'שגיאה': ''}
+                    for batch in iter_uploaded_batches(uploaded_files[0]):
+                        new_rows, duplicates = take_new_rows(batch)
+                        stats['שורות'] += len(batch)
+                        stats['כפילויות'] += duplicates
+                        if new_rows.empty:
+                            continue
+                        stored, error = append_expenses(apply_expense_schema(new_rows.copy()))
+                        stats['חדשות'] += sum(stored)
+                        if error:
+                            stats['שגיאה'] = error
+                            break
+                    summary.append(stats)
                 else:
+                    # Several files: parsed in parallel, deduplicated together, saved in one bulk write
+                    new_frames = []  # (stats of the file, its new rows)
+                    for result in parse_uploaded_files(uploaded_files):
+                        stats = {'קובץ': result['name'], 'שורות': 0, 'חדשות': 0, 'כפילויות': 0, 'שגיאה': result['error'] or ''}
+                        if result['rows'] is not None and not result['rows'].empty:
+                            new_rows, duplicates = take_new_rows(result['rows'])
+                            if not new_rows.empty:
+                                new_frames.append((stats, new_rows))
+                            stats.update({'שורות': len(result['rows']), 'כפילויות': duplicates})
+                        summary.append(stats)
+                    if new_frames:
+                        all_new = pd.concat([rows for _, rows in new_frames], ignore_index=True)
+                        stored, error = append_expenses(apply_expense_schema(all_new))
+                        # Credit each file only with its own rows that were written
+                        start = 0
+                        for stats, rows in new_frames:
+                            stats['חדשות'] = sum(stored[start:start + len(rows)])
+                            if stats['חדשות'] < len(rows):
+                                stats['שגיאה'] = error or "שמירת הרשומות נכשלה"
+                            start += len(rows)
+                
+                parsed = sum(stats['שורות'] for stats in summary)
+                added = sum(stats['חדשות'] for stats in summary)
+                duplicates = sum(stats['כפילויות'] for stats in summary)
+                for stats in summary:
+                    if stats['שגיאה']:
+                        st.error(f"❌ {stats['קובץ']}: {stats['שגיאה']}")
+                if not parsed:
                     st.error("❌ לא ניתן היה לפענח את הקובץ. וודא שהפורמט תקין.")
+                elif added:
+                    st.success(f"✅ נוספו {added} רשומות חדשות! ({duplicates} כפילויות סוננו)")
+                    st.info("💡 המערכת סיווגה אוטומטית הוצאות מוכרות. עבור לדף 'מיפוי' כדי לסווג את השאר.")
+                elif not any(stats['שגיאה'] for stats in summary):
+                    st.warning(f"⚠️ כל הרשומות בקובץ קיימות כבר במערכת ({duplicates} כפילויות).")
+                if len(summary) > 1:
+                    st.dataframe(pd.DataFrame(summary), hide_index=True, use_container_width=True)
 
     st.divider()
     
@@ -83,11 +107,8 @@ with tab1:
         col_confirm, col_cancel = st.columns(2)
         with col_confirm:
             if st.button("כן, מחק הכל"):
-                if os.path.exists("expenses.csv"):
-                    os.remove("expenses.csv")
-                    # Re-create empty
-                    df_empty = pd.DataFrame(columns=['חודש', 'תאריך רכישה', 'שם בית עסק', 'סכום עסקה', 'קטגוריה', 'הערות'])
-                    save_expenses(df_empty)
+                # Local (offline) data only - Supabase is never touched from here
+                clear_local_expenses()
                 st.success("כל הנתונים נמחקו.")
                 st.session_state['confirm_delete'] = False
                 st.rerun()
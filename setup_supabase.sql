@@ -1,4 +1,7 @@
 -- Copy and paste this into the SQL Editor in your Supabase Dashboard
+-- The script can be re-run on an existing database to add new sections.
+-- Note: the app pages through every table with `id=gt.<last>&order=id`,
+-- which is served by the primary key index on `id` - keep it on each table.
 
 -- 1. Create Expenses Table
 create table if not exists expenses (
@@ -38,6 +41,135 @@ alter table mapping enable row level security;
 -- Assuming you use the key from secrets in backend, it might bypass RLS if service_role used, 
 -- but 'supabase-py' usually uses Anon key by default unless configured otherwise.
 
+drop policy if exists "Enable all access for all users" on expenses;
 create policy "Enable all access for all users" on expenses for all using (true);
+drop policy if exists "Enable all access for all users" on categories;
 create policy "Enable all access for all users" on categories for all using (true);
+drop policy if exists "Enable all access for all users" on mapping;
 create policy "Enable all access for all users" on mapping for all using (true);
+
+-- 6. Delta sync: the app fetches only rows changed since its last sync.
+--    `updated_at` is maintained by a trigger; deleted ids are kept as tombstones.
+alter table expenses add column if not exists updated_at timestamp with time zone default timezone('utc'::text, now()) not null;
+create index if not exists expenses_updated_at_idx on expenses (updated_at);
+
+create or replace function set_updated_at() returns trigger as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists expenses_set_updated_at on expenses;
+create trigger expenses_set_updated_at
+  before insert or update on expenses
+  for each row execute function set_updated_at();
+
+create table if not exists expenses_deleted (
+  id bigint primary key,
+  deleted_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+create index if not exists expenses_deleted_deleted_at_idx on expenses_deleted (deleted_at);
+
+create or replace function record_expense_delete() returns trigger as $$
+begin
+  insert into expenses_deleted (id, deleted_at) values (old.id, now())
+  on conflict (id) do update set deleted_at = excluded.deleted_at;
+  return old;
+end;
+$$ language plpgsql;
+
+drop trigger if exists expenses_record_delete on expenses;
+create trigger expenses_record_delete
+  after delete on expenses
+  for each row execute function record_expense_delete();
+
+alter table expenses_deleted enable row level security;
+drop policy if exists "Enable all access for all users" on expenses_deleted;
+create policy "Enable all access for all users" on expenses_deleted for all using (true);
+
+-- 7. Dashboard aggregates: the home page reads these small views
+--    instead of downloading every expense.
+create or replace view expenses_monthly_summary with (security_invoker = on) as
+select
+  date_trunc('month', date)::date as month_start,
+  coalesce(category, '') as category,
+  sum(amount) as total,
+  count(*) as count
+from expenses
+where date is not null
+group by 1, 2;
+
+create or replace view expenses_yearly_summary with (security_invoker = on) as
+select
+  extract(year from date)::int as year,
+  coalesce(category, '') as category,
+  sum(amount) as total,
+  count(*) as count
+from expenses
+where date is not null
+group by 1, 2;
+
+create index if not exists expenses_date_idx on expenses (date);
+
+-- 8. Atomic bulk replace: rows are uploaded to a staging table under a batch id,
+--    then one function call merges them into `expenses` in a single transaction,
+--    so other sessions never see an empty or half-loaded table.
+--    Rows that carry an existing id keep it; the rest get new ids.
+create table if not exists expenses_staging (
+  seq bigint generated always as identity primary key,
+  batch_id uuid not null,
+  id bigint,
+  date text,
+  business text,
+  amount numeric,
+  category text,
+  notes text,
+  month text,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+create index if not exists expenses_staging_batch_idx on expenses_staging (batch_id, id);
+
+alter table expenses_staging enable row level security;
+drop policy if exists "Enable all access for all users" on expenses_staging;
+create policy "Enable all access for all users" on expenses_staging for all using (true);
+
+create or replace function replace_expenses_from_staging(p_batch uuid) returns integer as $$
+declare
+  total integer;
+begin
+  -- One replace at a time; readers keep seeing the old rows until commit
+  lock table expenses in share row exclusive mode;
+
+  delete from expenses e
+  where not exists (
+    select 1 from expenses_staging s where s.batch_id = p_batch and s.id = e.id
+  );
+
+  update expenses e set
+    date = nullif(s.date, '')::date,
+    business = s.business,
+    amount = s.amount,
+    category = s.category,
+    notes = s.notes,
+    month = s.month
+  from expenses_staging s
+  where s.batch_id = p_batch and s.id = e.id
+    and (e.date, e.business, e.amount, e.category, e.notes, e.month)
+        is distinct from (nullif(s.date, '')::date, s.business, s.amount, s.category, s.notes, s.month);
+
+  insert into expenses (date, business, amount, category, notes, month)
+  select nullif(s.date, '')::date, s.business, s.amount, s.category, s.notes, s.month
+  from expenses_staging s
+  where s.batch_id = p_batch
+    and (s.id is null or not exists (select 1 from expenses e where e.id = s.id))
+  order by s.seq;
+
+  -- Drop this batch and any batch abandoned by a failed upload
+  delete from expenses_staging
+  where batch_id = p_batch or created_at < now() - interval '1 day';
+
+  select count(*) into total from expenses;
+  return total;
+end;
+$$ language plpgsql;
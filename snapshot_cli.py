@@ -0,0 +1,54 @@
+"""
+Export / import the columnar expenses snapshot (Arrow IPC file).
+
+    python snapshot_cli.py export backup.arrow   # sync with Supabase and write the table
+    python snapshot_cli.py import backup.arrow   # seed the app's snapshot cache from a file
+    python snapshot_cli.py info backup.arrow     # show rows / watermark / source
+
+An imported snapshot lets a fresh deployment start with a delta sync
+instead of downloading the whole expenses table.
+"""
+import argparse
+import sys
+
+from supabase_io import read_snapshot, snapshot_available
+
+
+def info(path):
+    snapshot, watermark, source = read_snapshot(path)
+    print(f"File:      {path}")
+    print(f"Rows:      {len(snapshot)}")
+    print(f"Watermark: {watermark if watermark is not None else '-'}")
+    print(f"Source:    {source or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / import the expenses snapshot file")
+    parser.add_argument('command', choices=['export', 'import', 'info'])
+    parser.add_argument('path', help="Arrow IPC snapshot file")
+    args = parser.parse_args()
+
+    if not snapshot_available():
+        print("ERROR: pyarrow is not installed")
+        return 1
+
+    try:
+        if args.command == 'info':
+            info(args.path)
+            return 0
+
+        # Imported here so `info` works without Streamlit secrets
+        from utils import db
+        if args.command == 'export':
+            count = db.export_snapshot(args.path)
+            print(f"✅ Exported {count} expenses to {args.path}")
+        else:
+            count = db.import_snapshot(args.path)
+            print(f"✅ Imported {count} expenses into {db.snapshot_path}")
+    except Exception as e:
+        print(f"ERROR: {e}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,8 @@ import json
 import os
 import requests
 
+from supabase_io import expense_records, upload_chunks, failed_chunks
+
 # Constants
 EXPENSES_FILE = "expenses.csv"
 CATEGORIES_FILE = "categories.json"
@@ -35,61 +37,47 @@ def run_migration():
         "Content-Type": "application/json",
         "Prefer": "return=minimal"
     }
+    session = requests.Session()
 
     # Helper function for batch insert
-    def batch_insert(table_name, records):
+    def batch_insert(table_name, records, serialize=None):
         url = f"{base_url}/rest/v1/{table_name}"
         
         # 1. Delete existing (Truncate-like via delete all where id > 0)
         # Note: This requires the table to have an 'id' column and policy allowing delete.
         try:
              # Delete all rows where id is not null (basically all rows)
-             requests.delete(f"{url}?id=neq.0", headers=headers)
+             session.delete(f"{url}?id=neq.0", headers=headers)
         except Exception as e:
              print(f"Warning cleaning table {table_name}: {e}")
 
-        # 2. Insert in chunks
-        chunk_size = 1000
+        # 2. Insert in pipelined chunks (sized adaptively, failed chunks retried)
         total = len(records)
         print(f"  - Uploading {total} records to '{table_name}'...")
-        
-        for i in range(0, total, chunk_size):
-            chunk = records[i:i + chunk_size]
-            response = requests.post(url, headers=headers, json=chunk)
-            if response.status_code not in (200, 201, 204):
-                print(f"  ❌ Error batch {i}: {response.status_code} - {response.text}")
-            else:
-                pass # Success
-        print(f"  ✅ {table_name}: Done.")
+        report = upload_chunks(
+            lambda chunk: session.post(url, headers=headers, json=chunk), records, serialize=serialize
+        )
+
+        for entry in report:
+            status = '✅' if entry['ok'] else '❌'
+            print(f"    {status} rows {entry['start']}-{entry['start'] + entry['rows'] - 1}: "
+                  f"{entry['status']} in {entry['seconds']}s ({entry['attempts']} attempt(s))")
+        failed = failed_chunks(report)
+        if failed:
+            print(f"  ❌ {table_name}: {len(failed)} of {len(report)} chunks failed:")
+            for entry in failed:
+                print(f"    rows {entry['start']}+{entry['rows']}: {entry['error']}")
+        else:
+            print(f"  ✅ {table_name}: Done.")
 
     # 1. Migrate Expenses
     print("Migrating Expenses...")
     try:
         if os.path.exists(EXPENSES_FILE):
             df = pd.read_csv(EXPENSES_FILE, encoding='utf-8-sig')
-            records = []
-            for _, row in df.iterrows():
-                # Fix NaN values
-                row = row.where(pd.notnull(row), None)
-                
-                date = str(row.get('תאריך רכישה', ''))
-                business = str(row.get('שם בית עסק', ''))
-                amount = float(row.get('סכום עסקה', 0)) if row.get('סכום עסקה') else 0.0
-                category = str(row.get('קטגוריה', ''))
-                notes = str(row.get('הערות', ''))
-                month = str(row.get('חודש', ''))
-                
-                records.append({
-                    'date': date,
-                    'business': business,
-                    'amount': amount,
-                    'category': category,
-                    'notes': notes,
-                    'month': month
-                })
-            
-            if records:
-                batch_insert('expenses', records)
+            if not df.empty:
+                # Chunks are serialized while earlier ones upload
+                batch_insert('expenses', df, serialize=expense_records)
         else:
             print("⚠️ expenses.csv not found.")
     except Exception as e:
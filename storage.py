@@ -0,0 +1,379 @@
+"""
+Local storage backends used by SupabaseConnector when Supabase is unreachable
+(or not configured). Expenses are exchanged as DB-column records / frames
+(date, business, amount, category, notes, month + id), the same shape the
+Supabase REST API uses. Has no Streamlit dependency.
+"""
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+import pandas as pd
+
+from supabase_io import EXPENSE_DB_TO_DISPLAY, EXPENSE_DB_COLUMNS, expense_records
+
+DISPLAY_TO_DB = {display: db_col for db_col, display in EXPENSE_DB_TO_DISPLAY.items()}
+EXPENSE_COLUMNS = ['id'] + EXPENSE_DB_COLUMNS
+SUMMARY_KEYS = {'month': 'month_start', 'year': 'year'}
+
+
+class StorageBackend(ABC):
+    """Interface of a local store. `where` dicts use the PostgREST syntax of
+    `utils.load_expenses`; records are normalized DB-column dicts. A backend
+    missing any of these methods cannot be instantiated."""
+
+    # --- EXPENSES ---
+    @abstractmethod
+    def load_expenses(self, columns=None, where=None):
+        """DataFrame of ['id'] + `columns` (default: all DB columns) matching `where`."""
+
+    @abstractmethod
+    def query_expenses(self, where=None, order='date.desc,id.desc', limit=1000, offset=0):
+        """(page DataFrame, total matching rows)."""
+
+    @abstractmethod
+    def apply_expense_changes(self, inserts, updates, deleted_ids):
+        """Insert records, update records carrying an 'id', delete ids - atomically."""
+
+    @abstractmethod
+    def update_category(self, ids, category):
+        """Set the category of the given ids; returns the number of rows updated."""
+
+    @abstractmethod
+    def classify_business(self, business, category):
+        """Categorize the uncategorized rows of `business`; returns the row count."""
+
+    @abstractmethod
+    def summarize(self, by):
+        """Totals per month|year x category: [month_start|year, category, total, count]."""
+
+    # --- CATEGORIES / MAPPING ---
+    @abstractmethod
+    def load_categories(self):
+        """Category names, in their saved order."""
+
+    @abstractmethod
+    def save_categories(self, categories_list):
+        """Replace the category list with `categories_list`."""
+
+    @abstractmethod
+    def load_mapping(self):
+        """{business: category} of every mapping rule."""
+
+    @abstractmethod
+    def save_mapping(self, mapping_dict):
+        """Make the mapping rules equal to `mapping_dict`."""
+
+    @abstractmethod
+    def upsert_mapping_rule(self, business, category):
+        """Add or overwrite a single business -> category rule."""
+
+
+# ============================================
+# POSTGREST FILTERS -> SQL
+# ============================================
+def _split_filter_list(text):
+    """Split 'a,b.in.(1,2),"c,d"' on top-level commas (outside parens/quotes)."""
+    parts, current, depth, quoted = [], '', 0, False
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += ch
+    parts.append(current)
+    return parts
+
+def _column(name):
+    """DB column for a display or DB name; rejects anything else (it ends up in SQL)."""
+    col = DISPLAY_TO_DB.get(name, name)
+    if col not in EXPENSE_COLUMNS:
+        raise ValueError(f"Unknown expense column: {name}")
+    return col
+
+def _like_pattern(value):
+    """PostgREST '*' wildcards -> SQL LIKE pattern (escape character '\\')."""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped.replace('*', '%')
+
+def _filter_sql(col, expr):
+    """One PostgREST filter ('op.value') on `col` -> (sql, params)."""
+    op, _, value = expr.partition('.')
+    if op == 'not':
+        sql, params = _filter_sql(col, value)
+        return f"NOT ({sql})", params
+    if op == 'is':
+        if value == 'null':
+            return f"{col} IS NULL", []
+        return f"lower({col}) = ?", [value]
+    if op == 'in':
+        values = [v.strip().strip('"') for v in _split_filter_list(value.strip()[1:-1])]
+        return f"{col} IN ({','.join('?' * len(values))})", values
+    if op == 'ilike':
+        return f"{col} LIKE ? ESCAPE '\\'", [_like_pattern(value)]
+    if op == 'like':
+        # GLOB is case-sensitive and also uses '*' as its wildcard
+        glob = ''.join(f"[{ch}]" if ch in '[]?' else ch for ch in value)
+        return f"{col} GLOB ?", [glob]
+
+    compare = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+    if op not in compare:
+        raise ValueError(f"Unsupported filter operator: {op}")
+    return f"{col} {compare[op]} ?", [value]
+
+def _filter_list_sql(expr, joiner):
+    """PostgREST filter list '(a.op.v,and(b.op.v,c.op.v))' -> (sql, params), joined by `joiner`."""
+    parts, params = [], []
+    for part in _split_filter_list(str(expr).strip()[1:-1]):
+        group = part.partition('(')[0]
+        if group in ('and', 'or') and part.endswith(')'):
+            sql, sub_params = _filter_list_sql(part[len(group):], ' AND ' if group == 'and' else ' OR ')
+        else:
+            name, _, sub_expr = part.partition('.')
+            sql, sub_params = _filter_sql(_column(name), sub_expr)
+        parts.append(sql)
+        params.extend(sub_params)
+    return f"({joiner.join(parts)})", params
+
+def where_sql(where):
+    """Translate a `where` dict to a SQL condition (without WHERE) and its params."""
+    clauses, params = [], []
+    for key, expr in (where or {}).items():
+        if key == 'or':
+            sql, sub_params = _filter_list_sql(expr, ' OR ')
+            clauses.append(sql)
+            params.extend(sub_params)
+        else:
+            sql, sub_params = _filter_sql(_column(key), str(expr))
+            clauses.append(sql)
+            params.extend(sub_params)
+    return (' AND '.join(clauses) or '1=1'), params
+
+def order_sql(order):
+    """'date.desc,id.desc' -> 'date DESC, id DESC'."""
+    keys = []
+    for key in order.split(','):
+        col, _, direction = key.partition('.')
+        keys.append(f"{_column(col)} {'DESC' if direction == 'desc' else 'ASC'}")
+    return ', '.join(keys)
+
+
+# ============================================
+# SQLITE BACKEND
+# ============================================
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    business TEXT,
+    amount REAL,
+    category TEXT,
+    notes TEXT,
+    month TEXT
+);
+CREATE INDEX IF NOT EXISTS expenses_date_idx ON expenses (date);
+CREATE INDEX IF NOT EXISTS expenses_month_idx ON expenses (month);
+CREATE INDEX IF NOT EXISTS expenses_category_idx ON expenses (category);
+CREATE INDEX IF NOT EXISTS expenses_business_idx ON expenses (business);
+
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS mapping (
+    business TEXT PRIMARY KEY,
+    category TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Rows still waiting for a category
+UNCATEGORIZED_SQL = "(category IS NULL OR category = '')"
+
+
+class SqliteBackend(StorageBackend):
+    """Single-file SQLite store (stdlib). Each call uses its own short-lived
+    connection, so the backend is safe to use from worker threads."""
+
+    def __init__(self, path, legacy_files=None):
+        """`legacy_files` ({'expenses': csv, 'categories': json, 'mapping': json})
+        are imported once into a fresh database."""
+        self.path = path
+        with self._connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+        if legacy_files:
+            self._import_legacy_files(legacy_files)
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:  # commit on success, rollback on error
+                yield conn
+        finally:
+            conn.close()
+
+    def _import_legacy_files(self, legacy_files):
+        """Import the legacy files and set the `legacy_imported` flag in one
+        transaction, so a failed import is retried on the next start instead
+        of leaving a half-imported database."""
+        with self._connection() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return
+
+        try:
+            records = None
+            expenses_file = legacy_files.get('expenses')
+            if expenses_file and os.path.exists(expenses_file):
+                records = expense_records(pd.read_csv(expenses_file, encoding='utf-8-sig'))
+
+            loaded = {}
+            for key in ('categories', 'mapping'):
+                path = legacy_files.get(key)
+                if path and os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        loaded[key] = json.load(f)
+
+            with self._connection() as conn:
+                # Re-check inside the transaction - another process may have won the race
+                if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                    return
+                if records is not None:
+                    self._write_expense_changes(conn, records, [], [])
+                if 'categories' in loaded:
+                    self._write_categories(conn, loaded['categories'])
+                if 'mapping' in loaded:
+                    self._write_mapping(conn, loaded['mapping'])
+                conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', '1')")
+        except Exception as e:
+            print(f"[WARN] Could not import legacy files: {e}")
+            return
+
+        if records is not None:
+            print(f"[INFO] Imported {len(records)} expenses from {expenses_file}")
+
+    # --- EXPENSES ---
+    def load_expenses(self, columns=None, where=None):
+        cols = ['id'] + [_column(col) for col in (columns or EXPENSE_DB_COLUMNS) if _column(col) != 'id']
+        condition, params = where_sql(where)
+        with self._connection() as conn:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(cols)} FROM expenses WHERE {condition} ORDER BY id", conn, params=params
+            )
+
+    def query_expenses(self, where=None, order='date.desc,id.desc', limit=1000, offset=0):
+        condition, params = where_sql(where)
+        with self._connection() as conn:
+            total = conn.execute(f"SELECT count(*) FROM expenses WHERE {condition}", params).fetchone()[0]
+            page = pd.read_sql_query(
+                f"SELECT {', '.join(EXPENSE_COLUMNS)} FROM expenses WHERE {condition} "
+                f"ORDER BY {order_sql(order)} LIMIT ? OFFSET ?",
+                conn, params=params + [int(limit), int(offset)]
+            )
+        return page, total
+
+    def apply_expense_changes(self, inserts, updates, deleted_ids):
+        with self._connection() as conn:
+            self._write_expense_changes(conn, inserts, updates, deleted_ids)
+
+    @staticmethod
+    def _write_expense_changes(conn, inserts, updates, deleted_ids):
+        columns = ', '.join(EXPENSE_DB_COLUMNS)
+        assignments = ', '.join(f"{col} = ?" for col in EXPENSE_DB_COLUMNS)
+        conn.executemany("DELETE FROM expenses WHERE id = ?", [(int(row_id),) for row_id in deleted_ids])
+        conn.executemany(
+            f"UPDATE expenses SET {assignments} WHERE id = ?",
+            [[record[col] for col in EXPENSE_DB_COLUMNS] + [int(record['id'])] for record in updates]
+        )
+        conn.executemany(
+            f"INSERT INTO expenses ({columns}) VALUES ({', '.join('?' * len(EXPENSE_DB_COLUMNS))})",
+            [[record[col] for col in EXPENSE_DB_COLUMNS] for record in inserts]
+        )
+
+    def update_category(self, ids, category):
+        with self._connection() as conn:
+            cursor = conn.executemany(
+                "UPDATE expenses SET category = ? WHERE id = ?", [(category, int(row_id)) for row_id in ids]
+            )
+            return cursor.rowcount
+
+    def classify_business(self, business, category):
+        with self._connection() as conn:
+            cursor = conn.execute(
+                f"UPDATE expenses SET category = ? WHERE trim(business) = ? AND {UNCATEGORIZED_SQL}",
+                (category, business)
+            )
+            return cursor.rowcount
+
+    def summarize(self, by):
+        key_col = SUMMARY_KEYS[by]
+        key_sql = "substr(date, 1, 7) || '-01'" if by == 'month' else "CAST(substr(date, 1, 4) AS INTEGER)"
+        with self._connection() as conn:
+            return pd.read_sql_query(
+                f"SELECT {key_sql} AS {key_col}, coalesce(category, '') AS category, "
+                f"sum(amount) AS total, count(*) AS count "
+                f"FROM expenses WHERE date IS NOT NULL AND date != '' "
+                f"GROUP BY 1, 2 ORDER BY 1, 2",
+                conn
+            )
+
+    # --- CATEGORIES ---
+    def load_categories(self):
+        with self._connection() as conn:
+            return [name for (name,) in conn.execute("SELECT name FROM categories ORDER BY id")]
+
+    def save_categories(self, categories_list):
+        with self._connection() as conn:
+            self._write_categories(conn, categories_list)
+
+    @staticmethod
+    def _write_categories(conn, categories_list):
+        # The list is small and its order matters - replace it as a whole
+        conn.execute("DELETE FROM categories")
+        conn.executemany(
+            "INSERT OR IGNORE INTO categories (name) VALUES (?)", [(str(name),) for name in categories_list]
+        )
+
+    # --- MAPPING ---
+    def load_mapping(self):
+        with self._connection() as conn:
+            return dict(conn.execute("SELECT business, category FROM mapping"))
+
+    def save_mapping(self, mapping_dict):
+        """Write only the rules that changed and delete the ones that are gone."""
+        with self._connection() as conn:
+            self._write_mapping(conn, mapping_dict)
+
+    @staticmethod
+    def _write_mapping(conn, mapping_dict):
+        current = dict(conn.execute("SELECT business, category FROM mapping"))
+        conn.executemany(
+            "DELETE FROM mapping WHERE business = ?", [(name,) for name in current if name not in mapping_dict]
+        )
+        conn.executemany(
+            "INSERT INTO mapping (business, category) VALUES (?, ?) "
+            "ON CONFLICT (business) DO UPDATE SET category = excluded.category",
+            [(name, cat) for name, cat in mapping_dict.items() if current.get(name) != cat]
+        )
+
+    def upsert_mapping_rule(self, business, category):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO mapping (business, category) VALUES (?, ?) "
+                "ON CONFLICT (business) DO UPDATE SET category = excluded.category",
+                (business, category)
+            )
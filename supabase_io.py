@@ -0,0 +1,272 @@
+"""
+Expense serialization and snapshot files shared by the app (utils.py) and the
+standalone scripts. Has no Streamlit dependency so the scripts can import it.
+"""
+import os
+import time
+from datetime import date
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # snapshot files are an optimization - run without them
+    pa = pa_ipc = None
+
+# Supabase column name -> display (Hebrew) column name
+EXPENSE_DB_TO_DISPLAY = {
+    'date': 'תאריך רכישה',
+    'business': 'שם בית עסק',
+    'amount': 'סכום עסקה',
+    'category': 'קטגוריה',
+    'notes': 'הערות',
+    'month': 'חודש',
+    'id': 'id'
+}
+EXPENSE_DB_COLUMNS = ['date', 'business', 'amount', 'category', 'notes', 'month']
+# Display columns, in the order the pages show them (utils.COLUMNS)
+EXPENSE_COLUMNS = ['חודש', 'תאריך רכישה', 'שם בית עסק', 'סכום עסקה', 'קטגוריה', 'הערות']
+
+# Text values that mean "empty" once stringified (NaN / None leaking from pandas)
+_EMPTY_TEXT = ('nan', 'none', '<na>', 'nat')
+
+
+def _clean_text(col):
+    """Whole-column equivalent of `'' if missing else str(val).strip()`."""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col.dt.strftime('%Y-%m-%d').fillna('')
+    if col.dtype == object:
+        # Dates edited into an untyped column arrive as Timestamp / date objects
+        is_date = col.map(lambda val: isinstance(val, date) and not pd.isna(val))
+        if is_date.any():
+            col = col.copy()
+            col[is_date] = col[is_date].map(lambda val: val.strftime('%Y-%m-%d'))
+    text = col.astype(object).where(col.notna(), '').astype(str).str.strip()
+    return text.mask(text.str.lower().isin(_EMPTY_TEXT), '')
+
+
+def _clean_amount(col):
+    """Whole-column float coercion; unparsable or missing amounts become 0.0."""
+    return pd.to_numeric(col, errors='coerce').fillna(0.0).astype(float)
+
+
+def normalize_expenses(df):
+    """Display-column frame -> DB-column frame of normalized values.
+
+    Text columns become stripped strings ('' for NaN/None/'nan'), dates are
+    formatted as YYYY-MM-DD and amounts as floats. Missing columns are filled
+    with their empty value. The index of `df` is preserved.
+    """
+    out = pd.DataFrame(index=df.index)
+    for db_col in EXPENSE_DB_COLUMNS:
+        display = EXPENSE_DB_TO_DISPLAY[db_col]
+        if display in df.columns:
+            col = df[display]
+        else:
+            col = pd.Series(0.0 if db_col == 'amount' else '', index=df.index, dtype=object)
+        out[db_col] = _clean_amount(col) if db_col == 'amount' else _clean_text(col)
+    return out
+
+
+def frame_records(frame):
+    """Normalized DB-column frame (see `normalize_expenses`) -> list of records."""
+    # Zipping plain column lists is several times faster than to_dict('records')
+    columns = [frame[col].tolist() for col in EXPENSE_DB_COLUMNS]
+    return [dict(zip(EXPENSE_DB_COLUMNS, values)) for values in zip(*columns)]
+
+
+def expense_records(df):
+    """Display-column frame -> list of DB records ready to be sent as JSON."""
+    if df.empty:
+        return []
+    return frame_records(normalize_expenses(df))
+
+
+def parse_ids(col):
+    """Whole-column id parsing: ints, or NaN for new/blank rows."""
+    ids = pd.to_numeric(col.astype(object).where(col.notna(), None), errors='coerce')
+    return ids.where(ids.isna(), ids // 1)
+
+
+def expenses_by_id(df):
+    """Display-column frame -> normalized DB-column frame indexed by `id`.
+
+    This is the columnar form of the expenses snapshot. Rows without an id
+    are dropped; for a repeated id the last row wins.
+    """
+    frame = normalize_expenses(df)
+    if 'id' in df.columns:
+        ids = parse_ids(df['id'])
+    else:
+        ids = pd.Series(float('nan'), index=df.index)
+    keep = ids.notna().to_numpy()
+    frame = frame[keep]
+    frame.index = pd.Index(ids[keep].astype('int64'), name='id')
+    return frame[~frame.index.duplicated(keep='last')]
+
+
+# ============================================
+# PIPELINED BULK UPLOAD
+# ============================================
+UPLOAD_CHUNK_SIZE = 1000       # rows in the first chunk
+UPLOAD_MIN_CHUNK = 100
+UPLOAD_MAX_CHUNK = 5000
+UPLOAD_TARGET_SECONDS = 2.0    # chunk size adapts towards this response time
+UPLOAD_IN_FLIGHT = 3           # concurrent requests
+UPLOAD_RETRIES = 2             # extra attempts per failed chunk
+UPLOAD_RETRY_DELAY = 1         # seconds (multiplied by attempt number)
+
+# Statuses worth another attempt; other 4xx would fail again the same way
+_RETRYABLE_STATUS = (408, 429)
+# Statuses that say the request was not processed - the only ones safe to
+# replay for a non-idempotent insert (a timeout or 5xx may have committed it)
+_NOT_PROCESSED_STATUS = (408, 429, 503)
+
+
+def _send_chunk(send, records, retries, idempotent=False):
+    """POST one chunk (with retries) and describe the outcome."""
+    started = time.perf_counter()
+    status, error, response = None, None, None
+    for attempt in range(1, retries + 2):
+        try:
+            response = send(records)
+            status = response.status_code if response is not None else None
+            error = None if status in (200, 201, 204) else (response.text[:200] if response is not None else 'No response')
+        except Exception as e:
+            response, status, error = None, None, str(e)
+        if error is None:
+            break
+        if idempotent:
+            transient = status is None or status >= 500 or status in _RETRYABLE_STATUS
+        else:
+            transient = status in _NOT_PROCESSED_STATUS
+        if not transient or attempt > retries:
+            break
+        time.sleep(UPLOAD_RETRY_DELAY * attempt)
+    return {
+        'rows': len(records),
+        'ok': error is None,
+        'status': status,
+        'attempts': attempt,
+        'seconds': round(time.perf_counter() - started, 3),
+        'error': error,
+        'response': response,
+    }
+
+
+def upload_chunks(send, rows, serialize=None, chunk_size=UPLOAD_CHUNK_SIZE,
+                  max_in_flight=UPLOAD_IN_FLIGHT, retries=UPLOAD_RETRIES,
+                  min_chunk=UPLOAD_MIN_CHUNK, max_chunk=UPLOAD_MAX_CHUNK,
+                  target_seconds=UPLOAD_TARGET_SECONDS, idempotent=False):
+    """Upload `rows` in chunks through `send(records) -> response`.
+
+    `rows` is a list of records or a DataFrame; `serialize(rows[i:j])` turns a
+    slice into records (default: the slice itself). The next chunk is
+    serialized while up to `max_in_flight` earlier chunks are being sent, and
+    the chunk size moves towards `target_seconds` per request. `send` should
+    not retry by itself - this is the only retry layer. Failed chunks are
+    retried on 408 / 429 / 503; when `idempotent` (upserts) also on other 5xx
+    and timeouts, whose outcome is unknown and would duplicate plain inserts.
+
+    Returns one report dict per chunk, in row order: start, rows, ok, status,
+    attempts, seconds, error and the last response.
+    """
+    serialize = serialize or (lambda part: part)
+    total = len(rows)
+    report, pending = [], {}
+    start = 0
+
+    def collect(done):
+        nonlocal chunk_size
+        for future in done:
+            entry = {'start': pending.pop(future), **future.result()}
+            report.append(entry)
+            if entry['ok'] and entry['seconds'] > 0:
+                # Move halfway towards the size that would take target_seconds
+                ideal = int(entry['rows'] * target_seconds / entry['seconds'])
+                chunk_size = (chunk_size + ideal) // 2
+            elif not entry['ok']:
+                chunk_size //= 2
+            chunk_size = max(min_chunk, min(max_chunk, chunk_size))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        while start < total:
+            end = min(total, start + chunk_size)
+            part = rows.iloc[start:end] if isinstance(rows, pd.DataFrame) else rows[start:end]
+            records = serialize(part)
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[pool.submit(_send_chunk, send, records, retries, idempotent)] = start
+            start = end
+        collect(list(pending))
+
+    return sorted(report, key=lambda entry: entry['start'])
+
+
+def failed_chunks(report):
+    """Report entries whose upload did not succeed."""
+    return [entry for entry in report if not entry['ok']]
+
+
+# ============================================
+# COLUMNAR SNAPSHOT FILE
+# (Arrow IPC file holding the snapshot frame plus the delta-sync watermark)
+# ============================================
+SNAPSHOT_VERSION = '1'
+
+def snapshot_available():
+    """True if pyarrow is installed (snapshot files are skipped otherwise)."""
+    return pa is not None
+
+
+def _snapshot_schema(metadata):
+    fields = [pa.field('id', pa.int64())] + [
+        pa.field(col, pa.float64() if col == 'amount' else pa.string())
+        for col in EXPENSE_DB_COLUMNS
+    ]
+    return pa.schema(fields, metadata={key: str(val) for key, val in metadata.items()})
+
+
+def write_snapshot(path, snapshot, watermark=None, source=''):
+    """Write `snapshot` (see `expenses_by_id`) to `path` as an Arrow IPC file.
+
+    The watermark (ISO timestamp or None) and `source` (the Supabase URL the
+    rows came from) are stored in the schema metadata. The file is written
+    next to `path` and renamed over it, so readers never see a partial file.
+    """
+    columns = [pa.array(snapshot.index.to_numpy(dtype='int64'), type=pa.int64())] + [
+        pa.array(snapshot[col], type=pa.float64() if col == 'amount' else pa.string())
+        for col in EXPENSE_DB_COLUMNS
+    ]
+    metadata = {
+        'version': SNAPSHOT_VERSION,
+        'source': source or '',
+        'watermark': watermark.isoformat() if watermark is not None else '',
+    }
+    table = pa.Table.from_arrays(columns, schema=_snapshot_schema(metadata))
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa_ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return len(snapshot)
+
+
+def read_snapshot(path):
+    """Memory-map an Arrow IPC snapshot written by `write_snapshot`.
+
+    Returns (snapshot, watermark, source): the frame indexed by id, the
+    watermark as a Timestamp (None if unknown) and the source URL. Raises
+    ValueError for a file of another snapshot version.
+    """
+    with pa.memory_map(path, 'r') as source_file:
+        table = pa_ipc.open_file(source_file).read_all()
+    metadata = {key.decode(): val.decode() for key, val in (table.schema.metadata or {}).items()}
+    if metadata.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot version {metadata.get('version')!r}")
+    snapshot = table.to_pandas().set_index('id')[EXPENSE_DB_COLUMNS]
+    watermark = pd.Timestamp(metadata['watermark']) if metadata.get('watermark') else None
+    return snapshot, watermark, metadata.get('source', '')
@@ -0,0 +1,74 @@
+"""Paging of SupabaseConnector._fetch_pages against a fake PostgREST."""
+import json
+import os
+import sys
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, rows, headers):
+        self.status_code = 200
+        self.headers = headers
+        self._rows = rows
+        self.content = (pd.DataFrame(rows).to_csv(index=False) if rows else '').encode()
+
+    def json(self):
+        return self._rows
+
+
+class CappedSession:
+    """Serves `rows` ordered by id, at most `max_rows` per request and without a count."""
+
+    def __init__(self, rows, max_rows):
+        self.rows = rows
+        self.max_rows = max_rows
+        self.requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        rows = self.rows
+        limit = self.max_rows
+        for key, val in parse_qsl(urlsplit(url).query):
+            if key == 'id' and val.startswith('gt.'):
+                rows = [r for r in rows if r['id'] > int(val[3:])]
+            elif key == 'id' and val.startswith('lte.'):
+                rows = [r for r in rows if r['id'] <= int(val[4:])]
+            elif key == 'limit':
+                limit = min(limit, int(val))
+        return FakeResponse(rows[:limit], {})
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    monkeypatch.setattr(utils.SupabaseConnector, '_connect', lambda self: None)
+    conn = utils.SupabaseConnector()
+    conn.base_url = 'http://supabase.test'
+    conn.connected = True
+    return conn
+
+
+@pytest.mark.parametrize('csv_dtype', [None, {'id': 'int64', 'name': str}])
+def test_capped_pages_without_count_fetch_every_row(connector, csv_dtype):
+    rows = [{'id': i, 'name': f'row {i}'} for i in range(1, 2501)]
+    connector.session = CappedSession(rows, max_rows=100)
+
+    pages = connector._fetch_pages('categories', csv_dtype=csv_dtype)
+
+    if csv_dtype is None:
+        ids = [row['id'] for page in pages for row in page]
+    else:
+        ids = pd.concat(pages, ignore_index=True)['id'].tolist()
+    assert ids == list(range(1, 2501))
+    assert connector.session.requests == 26  # 25 full pages + the empty one that ends the walk
+
+
+def test_single_short_page_without_count(connector):
+    connector.session = CappedSession([{'id': 1, 'name': 'a'}], max_rows=100)
+    pages = connector._fetch_pages('categories')
+    assert [row['id'] for page in pages for row in page] == [1]
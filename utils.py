@@ -2,8 +2,12 @@ import streamlit as st
 import pandas as pd
 import os
 import re
+import threading
+import uuid
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
 
 # ============================================
 # DESIGN SYSTEM - NEW CYAN/BLUE THEME
@@ -24,11 +28,11 @@ COLORS = {
 }
 
 # Constants
-EXPENSES_FILE = "expenses.csv"
+EXPENSES_FILE = "expenses.csv"      # legacy local files, imported once into LOCAL_DB_FILE
 CATEGORIES_FILE = "categories.json"
 MAPPING_FILE = "mapping.json"
-
-COLUMNS = ['חודש', 'תאריך רכישה', 'שם בית עסק', 'סכום עסקה', 'קטגוריה', 'הערות']
+LOCAL_DB_FILE = "expenses.db"       # SQLite store used when Supabase is unreachable
+SNAPSHOT_FILE = "expenses_snapshot.arrow"  # last synced Supabase state, for fast cold starts
 
 DEFAULT_CATEGORIES = [
     "אוכל", "סופר", "דלק", "חשבונות", "ביטוח", 
@@ -36,8 +40,31 @@ DEFAULT_CATEGORIES = [
     "תחבורה", "בריאות", "אחר"
 ]
 
+import gzip
+import io
 import json
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:  # older Streamlit - worker threads just run without a context
+    add_script_run_ctx = get_script_run_ctx = None
+
+from storage import SqliteBackend
+from ingest import StatementError, normalize_statement, iter_statement_batches, parse_statements, PARSE_WORKERS
+from supabase_io import (
+    EXPENSE_DB_TO_DISPLAY, EXPENSE_DB_COLUMNS, EXPENSE_COLUMNS, normalize_expenses, expense_records, parse_ids,
+    frame_records, expenses_by_id,
+    upload_chunks, failed_chunks, UPLOAD_IN_FLIGHT,
+    snapshot_available, read_snapshot, write_snapshot
+)
+
+COLUMNS = EXPENSE_COLUMNS
+DISPLAY_TO_DB = {display: db_col for db_col, display in EXPENSE_DB_TO_DISPLAY.items()}
+
+# Rows still waiting for a category (`where=` filter for load_expenses)
+UNCATEGORIZED_FILTER = {'or': '(category.is.null,category.eq.)'}
 
 # ============================================
 # RETRY / TIMEOUT SETTINGS
@@ -46,17 +73,171 @@ MAX_RETRIES = 3
 RETRY_DELAY = 1   # seconds (multiplied by attempt number)
 REQUEST_TIMEOUT = 10  # seconds
 
+# ============================================
+# HTTP SESSION SETTINGS
+# (overridable per key in the [supabase] section of secrets.toml)
+# ============================================
+HTTP_POOL_CONNECTIONS = 4      # distinct hosts kept in the pool
+HTTP_POOL_MAXSIZE = 10         # open sockets per host
+HTTP_KEEPALIVE = True          # reuse TLS connections between requests
+GZIP_REQUESTS = False          # gzip large JSON bodies (gateway must accept Content-Encoding: gzip)
+GZIP_MIN_BYTES = 16 * 1024     # only compress bodies larger than this
+CSV_READS = False              # bulk expense reads as text/csv parsed by read_csv (no JSON dicts)
+
+# ============================================
+# PAGING SETTINGS
+# ============================================
+PAGE_SIZE = 1000   # rows per request (Supabase's default max-rows)
+LOAD_WORKERS = 4   # concurrent page requests per table
+FILTER_MAX_BYTES = 6 * 1024  # URL-encoded `in.(...)` filter per DELETE (gateways reject ~8KB+ URLs)
+
+# Column dtypes for expense pages read as CSV (empty field = NULL)
+EXPENSE_CSV_DTYPES = {
+    'id': 'int64', 'amount': 'float64', 'date': str, 'business': str, 'category': str,
+    'notes': str, 'month': str, 'created_at': str, 'updated_at': str,
+}
+
+# ============================================
+# DELTA SYNC SETTINGS
+# ============================================
+DELTA_SYNC = True      # after the first load, fetch only rows changed since the watermark
+SYNC_OVERLAP = 30      # seconds re-read before the watermark (late commits / clock skew)
+SNAPSHOT_CACHE = True  # keep the synced table in SNAPSHOT_FILE and delta-sync from it on restart
+
+# ============================================
+# ATOMIC REPLACE SETTINGS
+# ============================================
+STAGING_TABLE = 'expenses_staging'
+REPLACE_FUNCTION = 'replace_expenses_from_staging'
+STAGING_CHUNK_SIZE = 5000      # staged rows are invisible until the swap, so chunks can be large
+STAGING_MAX_CHUNK = 20000
+
+# ============================================
+# EXPENSE SCHEMA
+# (applied once when expenses are loaded; pages work on typed columns)
+# ============================================
+DATE_COLUMN = 'תאריך רכישה'
+AMOUNT_COLUMN = 'סכום עסקה'
+CATEGORY_COLUMNS = ['קטגוריה', 'חודש', 'שם בית עסק']   # few distinct values, stored once each
+TEXT_COLUMNS = ['הערות']
+
+def apply_expense_schema(df):
+    """Type the expense columns present in `df` (in place) and return it.
+
+    Dates become datetime64 (NaT when missing), categories / months /
+    business names `category` dtype, amounts float64 and ids nullable Int64.
+    """
+    if DATE_COLUMN in df.columns and not pd.api.types.is_datetime64_any_dtype(df[DATE_COLUMN]):
+        df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], errors='coerce', format='ISO8601')
+    if AMOUNT_COLUMN in df.columns:
+        df[AMOUNT_COLUMN] = pd.to_numeric(df[AMOUNT_COLUMN], errors='coerce').fillna(0.0).astype('float64')
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].fillna('').astype(str).astype('category')
+    for col in TEXT_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].fillna('').astype(str)
+    if 'id' in df.columns:
+        df['id'] = parse_ids(df['id']).astype('Int64')
+    return df
+
+def expense_keys(df):
+    """Duplicate-detection key per row: 'date|business|amount' on normalized values."""
+    records = normalize_expenses(df)
+    return records['date'] + '|' + records['business'] + '|' + records['amount'].astype(str)
+
+# ============================================
+# QUERY FILTERS (POSTGREST SYNTAX)
+# ============================================
+def _where_params(where):
+    """Encode a `where` dict as a PostgREST query string (DB column names)."""
+    params = []
+    for col, expr in (where or {}).items():
+        key = DISPLAY_TO_DB.get(col, col)
+        params.append(f"{key}={quote(str(expr), safe='')}")
+    return '&'.join(params)
+
+# ============================================
+# DASHBOARD AGGREGATES
+# ============================================
+SUMMARY_COLUMNS = {'month': 'month_start', 'year': 'year'}
+
+def _summarize_expenses(df, by):
+    """Aggregate display rows the way the Supabase summary views do.
+
+    `by` is 'month' or 'year'; returns [month_start|year, קטגוריה, total, count].
+    """
+    key_col = SUMMARY_COLUMNS[by]
+    dates = pd.to_datetime(df['תאריך רכישה'], errors='coerce') if not df.empty else pd.Series(dtype='datetime64[ns]')
+    frame = pd.DataFrame({
+        'date': dates,
+        'קטגוריה': df['קטגוריה'].astype(object).fillna('') if not df.empty else pd.Series(dtype=object),
+        'total': pd.to_numeric(df['סכום עסקה'], errors='coerce').fillna(0.0) if not df.empty else pd.Series(dtype=float),
+    })
+    frame = frame[frame['date'].notna()]
+    if by == 'month':
+        frame[key_col] = frame['date'].dt.to_period('M').dt.to_timestamp()
+    else:
+        frame[key_col] = frame['date'].dt.year
+    summary = frame.groupby([key_col, 'קטגוריה']).agg(total=('total', 'sum'), count=('total', 'size'))
+    return summary.reset_index()[[key_col, 'קטגוריה', 'total', 'count']]
+
+def get_latest_active_month_from_summary(monthly, min_transactions=20):
+    """
+    Get the latest month (MM/YYYY) in `load_monthly_summary()` that has at least
+    `min_transactions`. Fallback to the last month in data if none meet criteria.
+    If no data, return current month.
+    """
+    if monthly.empty:
+        return datetime.now().strftime('%m/%Y')
+    counts = monthly.groupby('month_start')['count'].sum()
+    active = counts[counts >= min_transactions]
+    latest = (active if not active.empty else counts).index.max()
+    return latest.strftime('%m/%Y')
+
 # ============================================
 # SUPABASE CONNECTOR (VIA REST API)
 # ============================================
+class SupabaseRequestError(RuntimeError):
+    """A Supabase request that did not succeed; `status` is the HTTP status."""
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
 class SupabaseConnector:
-    def __init__(self):
+    def __init__(self, storage=None):
         self.base_url = ""
         self.headers = {}
         self.connected = False
         self.connection_error = None
+        # Last loaded server state as normalized DB columns indexed by id (expenses_by_id),
+        # used to diff saves and for delta sync
+        self._expenses_snapshot = None
+        self._sync_watermark = None  # highest updated_at/deleted_at seen (server clock)
+        self._expenses_lock = threading.RLock()
+        self._mapping_snapshot = None  # last loaded {business: category}, used to diff saves
+        self.delta_sync = DELTA_SYNC
+        # Arrow file the snapshot is persisted to (None: disabled or pyarrow missing)
+        self.snapshot_path = SNAPSHOT_FILE if SNAPSHOT_CACHE and snapshot_available() else None
+        self.gzip_requests = GZIP_REQUESTS
+        self.csv_reads = CSV_READS
+        self.upload_in_flight = UPLOAD_IN_FLIGHT
+        self.last_upload_report = []  # per-chunk report of the last bulk upload
+        self.session = None
+        self._storage = storage  # local StorageBackend, created on first use
+        self._storage_lock = threading.Lock()
         self._connect()
 
+    @property
+    def storage(self):
+        """Local backend for offline mode (SQLite by default)."""
+        with self._storage_lock:  # load_all() may hit this from several threads at once
+            if self._storage is None:
+                self._storage = SqliteBackend(LOCAL_DB_FILE, legacy_files={
+                    'expenses': EXPENSES_FILE, 'categories': CATEGORIES_FILE, 'mapping': MAPPING_FILE
+                })
+        return self._storage
+
     def _connect(self):
         try:
             if "supabase" in st.secrets:
@@ -68,6 +249,11 @@ class SupabaseConnector:
                     "Content-Type": "application/json",
                     "Prefer": "return=minimal"
                 }
+                self.session = self._create_session(st.secrets["supabase"])
+                self.delta_sync = bool(st.secrets["supabase"].get("DELTA_SYNC", DELTA_SYNC))
+                self.upload_in_flight = int(st.secrets["supabase"].get("UPLOAD_IN_FLIGHT", UPLOAD_IN_FLIGHT))
+                if not st.secrets["supabase"].get("SNAPSHOT_CACHE", SNAPSHOT_CACHE):
+                    self.snapshot_path = None
                 self.connected = True
             else:
                 self.connection_error = "No 'supabase' section in st.secrets"
@@ -75,10 +261,40 @@ class SupabaseConnector:
             self.connection_error = str(e)
             st.warning(f"⚠️ שגיאת חיבור למסד נתונים: {e}")
 
+    def _create_session(self, config):
+        """Build a pooled keep-alive session shared by all requests of this connector."""
+        pool_connections = int(config.get("HTTP_POOL_CONNECTIONS", HTTP_POOL_CONNECTIONS))
+        pool_maxsize = int(config.get("HTTP_POOL_MAXSIZE", HTTP_POOL_MAXSIZE))
+        keepalive = bool(config.get("HTTP_KEEPALIVE", HTTP_KEEPALIVE))
+        self.gzip_requests = bool(config.get("GZIP_REQUESTS", GZIP_REQUESTS))
+        self.csv_reads = bool(config.get("CSV_READS", CSV_READS))
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if keepalive:
+            session.headers.update({"Connection": "keep-alive"})
+        else:
+            session.headers.update({"Connection": "close"})
+        return session
+
+    def _compress_body(self, kwargs):
+        """Replace a large `json=` payload with a gzipped body (if enabled)."""
+        if not self.gzip_requests or kwargs.get('json') is None:
+            return
+        body = json.dumps(kwargs['json'], ensure_ascii=False).encode('utf-8')
+        if len(body) < GZIP_MIN_BYTES:
+            return
+        kwargs.pop('json')
+        kwargs['data'] = gzip.compress(body)
+        kwargs['headers'] = {**kwargs['headers'], "Content-Encoding": "gzip"}
+
     def _request_with_retry(self, method, url, **kwargs):
         """Make an HTTP request with retry logic and timeout."""
         kwargs.setdefault('timeout', REQUEST_TIMEOUT)
         kwargs.setdefault('headers', self.headers)
+        self._compress_body(kwargs)
         last_error = None
         for attempt in range(MAX_RETRIES):
             try:
@@ -99,189 +315,740 @@ class SupabaseConnector:
                 raise
         return None  # Should not reach here
 
+    # --- PAGED READS ---
+    @staticmethod
+    def _parse_total(content_range):
+        """Total row count from a PostgREST Content-Range header ('0-999/4321')."""
+        try:
+            total = content_range.split('/')[-1]
+            return None if total == '*' else int(total)
+        except (AttributeError, ValueError):
+            return None
+
+    @staticmethod
+    def _read_page(response, csv_dtype=None):
+        """Decode one page: a list of dicts (JSON), or a DataFrame when `csv_dtype` is given."""
+        if csv_dtype is None:
+            return response.json()
+        try:
+            # Only empty fields are NULL - a business called "NA" stays a string
+            return pd.read_csv(io.BytesIO(response.content), dtype=csv_dtype,
+                               keep_default_na=False, na_values=[''])
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+
+    @staticmethod
+    def _last_id(page):
+        return int(page['id'].iat[-1]) if isinstance(page, pd.DataFrame) else page[-1]['id']
+
+    def _fetch_after(self, url, after_id, upto_id=None, limit=PAGE_SIZE, csv_dtype=None):
+        """Keyset-page through rows with after_id < id <= upto_id, ordered by id.
+
+        Returns the list of pages (see `_read_page`).
+        """
+        headers = {**self.headers, "Accept": "text/csv"} if csv_dtype is not None else self.headers
+        pages = []
+        while True:
+            paged_url = f"{url}&id=gt.{after_id}&limit={limit}"
+            if upto_id is not None:
+                paged_url += f"&id=lte.{upto_id}"
+            response = self._request_with_retry(self.session.get, paged_url, headers=headers)
+            self._ensure_ok(response, "טעינת נתונים")
+            page = self._read_page(response, csv_dtype)
+            pages.append(page)
+            if len(page) < limit:
+                return pages
+            after_id = self._last_id(page)
+
+    def _fetch_all_rows(self, table, select='*', filters=''):
+        """Fetch every row of `table` as a list of dicts, ordered by id."""
+        return [row for page in self._fetch_pages(table, select, filters) for row in page]
+
+    def _fetch_all_frame(self, table, select='*', filters='', csv_dtype=None):
+        """Fetch every row of `table` as a DataFrame, ordered by id.
+
+        With CSV_READS the pages are requested as text/csv and parsed straight
+        into typed columns, skipping the per-row dicts of the JSON decoder.
+        """
+        if not self.csv_reads or csv_dtype is None:
+            return pd.DataFrame(self._fetch_all_rows(table, select, filters))
+        pages = self._fetch_pages(table, select, filters, csv_dtype)
+        return pd.concat(pages, ignore_index=True) if len(pages) > 1 else pages[0]
+
+    def _fetch_pages(self, table, select='*', filters='', csv_dtype=None):
+        """Fetch every row of `table` as a list of pages, ordered by id.
+
+        Pages use keyset pagination (`id=gt.<last>&order=id`) so every page is a
+        primary-key index range scan. The first page also asks for the exact
+        row count; the rest of the id range is then split into windows that
+        are fetched concurrently and reassembled in order.
+        Raises on any failed page so callers never get a partial table.
+        """
+        url = f"{self.base_url}/rest/v1/{table}?select={select}&order=id"
+        if filters:
+            url += f"&{filters}"
+        count_headers = {**self.headers, "Prefer": "count=exact"}
+        if csv_dtype is not None:
+            count_headers["Accept"] = "text/csv"
+        response = self._request_with_retry(
+            self.session.get, f"{url}&limit={PAGE_SIZE}", headers=count_headers
+        )
+        self._ensure_ok(response, "טעינת נתונים")
+        first = self._read_page(response, csv_dtype)
+        pages = [first]
+        if not len(first):
+            return pages
+
+        # The server may cap page size below PAGE_SIZE - step by what it returned
+        step = len(first)
+        last_id = self._last_id(first)
+        total = self._parse_total(response.headers.get('Content-Range'))
+        if total is None:
+            # Count unavailable - the first page is full by definition of `step`,
+            # so walk the remaining keys one page at a time until a short page
+            pages.extend(self._fetch_after(url, last_id, limit=step, csv_dtype=csv_dtype))
+            return pages
+        remaining = total - step
+        if remaining <= 0:
+            return pages
+
+        # Highest id right now bounds the scan (rows inserted later are not included)
+        response = self._request_with_retry(
+            self.session.get,
+            f"{self.base_url}/rest/v1/{table}?select=id&order=id.desc&limit=1" + (f"&{filters}" if filters else "")
+        )
+        self._ensure_ok(response, "טעינת נתונים")
+        top = response.json()
+        max_id = top[0]['id'] if top else last_id
+        if max_id <= last_id:
+            return pages
+
+        windows = min(LOAD_WORKERS, -(-remaining // step), max_id - last_id)
+        bounds = [last_id + (max_id - last_id) * k // windows for k in range(windows + 1)]
+        with ThreadPoolExecutor(max_workers=windows) as pool:
+            windows_pages = pool.map(
+                lambda k: self._fetch_after(url, bounds[k], bounds[k + 1], step, csv_dtype), range(windows)
+            )
+            for window in windows_pages:
+                pages.extend(window)
+        return pages
+
     # --- EXPENSES ---
-    def load_expenses(self):
+    def _expenses_frame(self):
+        """Build the display DataFrame from the current snapshot."""
+        if self._expenses_snapshot is None or self._expenses_snapshot.empty:
+            return apply_expense_schema(pd.DataFrame(columns=COLUMNS))
+        df = self._expenses_snapshot.reset_index().rename(columns=EXPENSE_DB_TO_DISPLAY)
+        return apply_expense_schema(df[COLUMNS + ['id']])
+
+    def _snapshot_drop(self, ids):
+        """Remove `ids` from the snapshot (no-op without one)."""
+        if self._expenses_snapshot is not None and len(ids):
+            self._expenses_snapshot = self._expenses_snapshot.drop(ids, errors='ignore')
+
+    def _snapshot_put(self, rows):
+        """Overwrite / append `rows` (a frame like the snapshot) in the snapshot.
+
+        Known ids keep their position, new ids are appended - the same order
+        a dict update would give.
+        """
+        snapshot = self._expenses_snapshot
+        if snapshot is None or rows.empty:
+            return
+        known = rows.index.isin(snapshot.index)
+        if known.any():
+            for col in EXPENSE_DB_COLUMNS:
+                snapshot.loc[rows.index[known], col] = rows.loc[known, col].to_numpy()
+        if not known.all():
+            self._expenses_snapshot = pd.concat([snapshot, rows.loc[~known, EXPENSE_DB_COLUMNS]])
+
+    def _load_expenses_full(self):
+        """Fetch the whole table and reset the snapshot and sync watermark."""
+        frame = self._fetch_all_frame('expenses', csv_dtype=EXPENSE_CSV_DTYPES)
+        self._expenses_snapshot = self._records_from_db(frame)
+        # Tables without the updated_at trigger simply never switch to delta mode
+        self._sync_watermark = self._max_timestamp(frame.get('updated_at', []))
+        self._persist_snapshot()
+
+    def _load_expenses_delta(self):
+        """Merge rows changed or deleted since the last sync into the snapshot."""
+        since = self._sync_watermark - timedelta(seconds=SYNC_OVERLAP)
+        since_param = quote(since.isoformat())
+        tombstones = self._fetch_all_rows(
+            'expenses_deleted', select='id,deleted_at', filters=f"deleted_at=gte.{since_param}"
+        )
+        changed = self._fetch_all_frame(
+            'expenses', filters=f"updated_at=gte.{since_param}", csv_dtype=EXPENSE_CSV_DTYPES
+        )
+
+        # Deletions first, so an id deleted and re-inserted since the watermark survives
+        deleted = [self._parse_id(item.get('id')) for item in tombstones]
+        self._snapshot_drop([row_id for row_id in deleted if row_id is not None])
+        self._snapshot_put(self._records_from_db(changed))
+
+        self._sync_watermark = self._max_timestamp(
+            [self._sync_watermark]
+            + list(changed.get('updated_at', []))
+            + [item.get('deleted_at') for item in tombstones]
+        )
+        if tombstones or len(changed):
+            self._persist_snapshot()
+
+    def _persist_snapshot(self):
+        """Write the snapshot and watermark to the snapshot file (best effort)."""
+        if not self.snapshot_path or self._expenses_snapshot is None or self._sync_watermark is None:
+            return
+        try:
+            write_snapshot(self.snapshot_path, self._expenses_snapshot, self._sync_watermark, self.base_url)
+        except Exception as e:
+            print(f"[WARN] Could not write {self.snapshot_path}: {e}")
+
+    def _restore_snapshot(self):
+        """Load the snapshot file written by an earlier run, if it matches this project.
+
+        Only the rows changed since its watermark then need to be fetched.
+        Returns True if the in-memory snapshot was restored.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            snapshot, watermark, source = read_snapshot(self.snapshot_path)
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable {self.snapshot_path}: {e}")
+            return False
+        if source != self.base_url or watermark is None:
+            return False
+        self._expenses_snapshot = snapshot
+        self._sync_watermark = watermark
+        print(f"[INFO] Restored {len(snapshot)} expenses from {self.snapshot_path} (synced {watermark})")
+        return True
+
+    def export_snapshot(self, path):
+        """Sync with Supabase and write the current table to `path`. Returns the row count."""
+        if not snapshot_available():
+            raise RuntimeError("pyarrow is required for snapshot files")
+        if not self.connected:
+            raise RuntimeError(f"Not connected to Supabase: {self.connection_error}")
+        with self._expenses_lock:
+            _, ok = self.load_expenses()
+            if not ok or self._expenses_snapshot is None:
+                raise RuntimeError("Could not load expenses from Supabase")
+            return write_snapshot(path, self._expenses_snapshot, self._sync_watermark, self.base_url)
+
+    def import_snapshot(self, path):
+        """Seed the snapshot cache from a file made by `export_snapshot`.
+
+        The next load only fetches rows changed since the file's watermark.
+        Returns the row count. Raises if the snapshot cache is disabled.
+        """
+        if not snapshot_available():
+            raise RuntimeError("pyarrow is required for snapshot files")
+        if not self.snapshot_path:
+            raise RuntimeError("Snapshot cache is disabled (SNAPSHOT_CACHE = false) - nothing to import into")
+        snapshot, watermark, source = read_snapshot(path)
+        if source != self.base_url:
+            raise ValueError(f"snapshot was taken from {source or 'an unknown project'}, not {self.base_url}")
+        if watermark is None:
+            raise ValueError("snapshot has no sync watermark")
+        with self._expenses_lock:
+            self._expenses_snapshot = snapshot
+            self._sync_watermark = watermark
+            # Not _persist_snapshot(): a failed write must fail the import
+            write_snapshot(self.snapshot_path, snapshot, watermark, self.base_url)
+        return len(snapshot)
+
+    @staticmethod
+    def _max_timestamp(values):
+        stamps = pd.to_datetime(pd.Series(list(values), dtype=object), utc=True, format='ISO8601', errors='coerce')
+        latest = stamps.max()
+        return None if pd.isna(latest) else latest
+
+    def load_expenses(self, columns=None, where=None):
+        """Load expenses as a display frame. Returns (df, ok) - `ok` is False
+        when the rows came from the local fallback instead of Supabase."""
+        if columns is not None or where:
+            return self._query_expenses(columns, where)
         if self.connected:
             for attempt in range(MAX_RETRIES):
                 try:
-                    url = f"{self.base_url}/rest/v1/expenses?select=*"
-                    all_data = []
-                    offset = 0
-                    limit = 1000
-                    fetch_error = False
-                    
-                    while True:
-                        paged_url = f"{url}&limit={limit}&offset={offset}"
-                        response = self._request_with_retry(requests.get, paged_url)
-
-                        if response is not None and response.status_code == 200:
-                            data = response.json()
-                            if not data:
-                                break
-                            all_data.extend(data)
-                            
-                            if len(data) < limit:
-                                break
-                            
-                            offset += limit
+                    with self._expenses_lock:
+                        if self._expenses_snapshot is None and self.delta_sync:
+                            # Cold start: reconcile the file from the last run instead of a full fetch
+                            self._restore_snapshot()
+                        can_delta = (
+                            self.delta_sync
+                            and self._expenses_snapshot is not None
+                            and self._sync_watermark is not None
+                        )
+                        if can_delta:
+                            try:
+                                self._load_expenses_delta()
+                            except SupabaseRequestError as e:
+                                if isinstance(e.status, int) and 400 <= e.status < 500:
+                                    # Schema not migrated for delta sync - stop trying
+                                    self.delta_sync = False
+                                self._load_expenses_full()
                         else:
-                            status = response.status_code if response else 'No response'
-                            fetch_error = True
-                            break
-                    
-                    if fetch_error:
-                        if attempt < MAX_RETRIES - 1:
-                            time.sleep(RETRY_DELAY * (attempt + 1))
-                            continue
-                        st.warning(f"⚠️ שגיאה בטעינת הוצאות מהשרת (סטטוס: {status}). מנסה מקור מקומי.")
-                        break
-                    
-                    if all_data:
-                        df = pd.DataFrame(all_data)
-                        
-                        if not df.empty:
-                            rename_map = {
-                                'date': 'תאריך רכישה',
-                                'business': 'שם בית עסק',
-                                'amount': 'סכום עסקה',
-                                'category': 'קטגוריה',
-                                'notes': 'הערות',
-                                'month': 'חודש',
-                                'id': 'id'
-                            }
-                            df = df.rename(columns=rename_map)
-                            df.replace(['None', 'nan', 'NONE', 'NaN'], '', inplace=True)
-                            
-                            for col in COLUMNS:
-                                if col not in df.columns:
-                                    df[col] = ''
-                            
-                            cols_to_return = COLUMNS + ['id'] if 'id' in df.columns else COLUMNS
-                            return df[cols_to_return]
-                    
-                    if not all_data:
-                         return pd.DataFrame(columns=COLUMNS)
+                            self._load_expenses_full()
+                        df = self._expenses_frame()
+                    return df, True
 
                 except Exception as e:
+                    self._expenses_snapshot = None
                     if attempt < MAX_RETRIES - 1:
                         time.sleep(RETRY_DELAY * (attempt + 1))
                         continue
-                    st.warning(f"⚠️ לא ניתן לטעון הוצאות מהשרת: {e}")
+                    st.warning(f"⚠️ לא ניתן לטעון הוצאות מהשרת: {e}. מנסה מקור מקומי.")
                     break
-        return self._load_local_expenses()
+        return self._load_local_expenses(), False
+
+    def _query_expenses(self, columns, where):
+        """Projected/filtered read; bypasses the snapshot and delta sync."""
+        display_cols = list(columns) if columns else list(COLUMNS)
+        if self.connected:
+            try:
+                db_cols = [DISPLAY_TO_DB[col] for col in display_cols]
+                frame = self._fetch_all_frame(
+                    'expenses', select=','.join(['id'] + db_cols), filters=_where_params(where),
+                    csv_dtype=EXPENSE_CSV_DTYPES
+                )
+                df = frame.reindex(columns=['id'] + db_cols).rename(columns=EXPENSE_DB_TO_DISPLAY)
+                return apply_expense_schema(df[display_cols + ['id']]), True
+            except Exception as e:
+                st.warning(f"⚠️ לא ניתן לטעון הוצאות מהשרת: {e}. מנסה מקור מקומי.")
+        df = self.storage.load_expenses(columns=[DISPLAY_TO_DB[col] for col in display_cols], where=where)
+        return apply_expense_schema(df.rename(columns=EXPENSE_DB_TO_DISPLAY)[display_cols + ['id']]), False
+
+    def query_expenses(self, where=None, order='date.desc,id.desc', limit=PAGE_SIZE, offset=0):
+        """One page of filtered expenses plus the total number of matching rows.
+
+        Filtering, sorting and paging all happen in PostgREST; see `load_expenses`
+        for the `where` format. Returns ((df, total), ok), `ok` as in `load_expenses`.
+        """
+        if self.connected:
+            try:
+                params = _where_params(where)
+                url = f"{self.base_url}/rest/v1/expenses?select=*&order={order}&limit={limit}&offset={offset}"
+                if params:
+                    url += f"&{params}"
+                count_headers = {**self.headers, "Prefer": "count=exact"}
+                response = self._request_with_retry(self.session.get, url, headers=count_headers)
+                self._ensure_ok(response, "טעינת הוצאות")
+                rows = response.json()
+                total = self._parse_total(response.headers.get('Content-Range'))
+                raw = pd.DataFrame(rows, columns=EXPENSE_DB_COLUMNS + ['id'])
+                df = normalize_expenses(raw.rename(columns=EXPENSE_DB_TO_DISPLAY))
+                df['id'] = raw['id']
+                df = apply_expense_schema(df.rename(columns=EXPENSE_DB_TO_DISPLAY)[COLUMNS + ['id']])
+                return (df, (total if total is not None else offset + len(df))), True
+            except Exception as e:
+                st.warning(f"⚠️ לא ניתן לטעון הוצאות מהשרת: {e}. מנסה מקור מקומי.")
+        df, total = self.storage.query_expenses(where, order, limit, offset)
+        return (apply_expense_schema(df.rename(columns=EXPENSE_DB_TO_DISPLAY)[COLUMNS + ['id']]), total), False
+
+    def save_expense_changes(self, original_df, edited_df):
+        """Persist edits made to a subset of rows (e.g. one page of the editor).
+
+        `original_df` is the subset as loaded and `edited_df` the same subset
+        after editing: ids missing from `edited_df` are deleted, changed rows are
+        updated and rows without an id are inserted. Rows outside the subset
+        are never touched.
+        """
+        if self.connected:
+            try:
+                baseline = expenses_by_id(original_df)
+                with self._expenses_lock:
+                    inserts, updates, deleted_ids = self._diff_expenses(edited_df, baseline)
+                    self._apply_expense_changes(inserts, updates, deleted_ids)
+            except Exception as e:
+                self._expenses_snapshot = None
+                st.warning(f"⚠️ שגיאה בשמירת הוצאות: {e}")
+            return
+        self._save_local_changes(original_df, edited_df)
+
+    def append_expenses(self, df):
+        """Insert every row of `df` as a new expense (any `id` column is ignored).
+
+        Returns (stored, error): `stored` has one bool per row of `df`, True for
+        rows that were written; `error` describes the failure, or is None.
+        """
+        records = expense_records(df.drop(columns=['id'], errors='ignore'))
+        if not self.connected:
+            self.storage.apply_expense_changes(records, [], [])
+            return [True] * len(records), None
+        stored = [False] * len(records)
+        try:
+            with self._expenses_lock:
+                report = self._insert_expenses(records)
+            for entry in report:
+                stored[entry['start']:entry['start'] + entry['rows']] = [entry['ok']] * entry['rows']
+            self._ensure_uploaded(report, "הוספת הוצאות")
+        except Exception as e:
+            return stored, str(e)
+        return stored, None
 
     def save_expenses(self, df):
+        """Persist `df` by sending only the rows that changed since the last load.
+
+        Rows are matched to the last loaded snapshot by `id`: rows without a known
+        id are inserted, rows whose fields differ are updated and snapshot ids
+        missing from `df` are deleted. Use `rebuild_expenses` for a full rewrite.
+        """
         if self.connected:
             try:
-                records = []
-                for _, row in df.iterrows():
-                    def safe_str(val):
-                        if pd.isna(val) or val is None or str(val).lower() == 'nan' or str(val).lower() == 'none':
-                            return ''
-                        return str(val).strip()
-                    
-                    def safe_float(val):
-                        try:
-                            return float(val)
-                        except:
-                            return 0.0
-
-                    records.append({
-                        'date': safe_str(row.get('תאריך רכישה')),
-                        'business': safe_str(row.get('שם בית עסק')),
-                        'amount': safe_float(row.get('סכום עסקה')),
-                        'category': safe_str(row.get('קטגוריה')),
-                        'notes': safe_str(row.get('הערות')),
-                        'month': safe_str(row.get('חודש'))
-                    })
-                
+                with self._expenses_lock:
+                    if self._expenses_snapshot is None:
+                        # Nothing to diff against yet - fetch the current server state
+                        self.load_expenses()
+                    if self._expenses_snapshot is None:
+                        raise SupabaseRequestError("טעינת ההוצאות מהשרת נכשלה", None)
+                    inserts, updates, deleted_ids = self._diff_expenses(df)
+                    self._apply_expense_changes(inserts, updates, deleted_ids)
+            except Exception as e:
+                self._expenses_snapshot = None
+                st.warning(f"⚠️ שגיאה בשמירת הוצאות: {e}")
+            return
+        self._save_local_expenses(df)
+
+    def rebuild_expenses(self, df):
+        """Replace the whole expenses table with `df`.
+
+        Uses the atomic staged replace; databases without the staging table
+        (setup_supabase.sql section 8) fall back to delete all + reinsert.
+        """
+        if self.connected:
+            try:
+                try:
+                    return self._replace_expenses_staged(df)
+                except SupabaseRequestError as e:
+                    if e.status != 404:
+                        raise
+                    print(f"[WARN] {STAGING_TABLE} not available ({e}), rebuilding with delete + insert")
+
                 url = f"{self.base_url}/rest/v1/expenses"
+                # Abort if the old rows are still there - reinserting would duplicate every expense
+                response = self._request_with_retry(self.session.delete, f"{url}?id=neq.0")
+                self._ensure_ok(response, "מחיקת הוצאות")
+
+                # Each chunk is serialized while the previous ones are in flight
+                report = self._bulk_post(url, df, serialize=expense_records)
+
+                # Server-side ids changed - force a fresh snapshot on next save
+                self._expenses_snapshot = None
+                self._ensure_uploaded(report, "הוספת הוצאות")
+                return report
+            except Exception as e:
+                st.warning(f"⚠️ שגיאה בשמירת הוצאות: {e}")
+                return None
+        self._save_local_expenses(df)
+
+    def replace_expenses_atomic(self, df):
+        """Replace the whole expenses table with `df` in one transaction.
+
+        Rows are uploaded to the staging table and merged by a single RPC call,
+        so readers see either the old or the new table, never a partial one.
+        Rows of `df` with an `id` keep it. Returns the per-chunk upload report.
+        """
+        if self.connected:
+            try:
+                return self._replace_expenses_staged(df)
+            except Exception as e:
+                st.warning(f"⚠️ שגיאה בשמירת הוצאות: {e}")
+                return None
+        self._save_local_expenses(df)
+        return None
+
+    def _replace_expenses_staged(self, df):
+        batch_id = str(uuid.uuid4())
+        staging_url = f"{self.base_url}/rest/v1/{STAGING_TABLE}"
+
+        def serialize(part):
+            records = expense_records(part)
+            ids = parse_ids(part['id']) if 'id' in part.columns else [None] * len(records)
+            return [
+                {**record, 'batch_id': batch_id, 'id': None if pd.isna(row_id) else int(row_id)}
+                for record, row_id in zip(records, ids)
+            ]
+
+        with self._expenses_lock:
+            try:
+                report = self._bulk_post(
+                    staging_url, df, serialize=serialize,
+                    chunk_size=STAGING_CHUNK_SIZE, max_chunk=STAGING_MAX_CHUNK
+                )
+                self._ensure_uploaded(report, "העלאת הוצאות")
+                response = self._request_with_retry(
+                    self.session.post, f"{self.base_url}/rest/v1/rpc/{REPLACE_FUNCTION}",
+                    json={'p_batch': batch_id}
+                )
+                self._ensure_ok(response, "החלפת הוצאות")
+            except Exception:
+                # Best effort - the function also clears batches older than a day
                 try:
-                    self._request_with_retry(requests.delete, f"{url}?id=neq.0")
+                    self._request_with_retry(self.session.delete, f"{staging_url}?batch_id=eq.{batch_id}")
                 except Exception:
                     pass
+                raise
+            # New rows got server-side ids - force a fresh snapshot on next save
+            self._expenses_snapshot = None
+        return report
 
-                chunk_size = 1000
-                for i in range(0, len(records), chunk_size):
-                    chunk = records[i:i + chunk_size]
-                    self._request_with_retry(requests.post, url, json=chunk)
-                    
-                return
+    @staticmethod
+    def _records_from_db(items):
+        """Snapshot frame for rows as returned by Supabase (English keys): a list of dicts or a DataFrame."""
+        frame = items if isinstance(items, pd.DataFrame) else pd.DataFrame(items)
+        return expenses_by_id(frame.rename(columns=EXPENSE_DB_TO_DISPLAY))
+
+    @staticmethod
+    def _parse_id(val):
+        """Return `val` as an int id, or None for new/blank rows."""
+        try:
+            if val is None or pd.isna(val) or str(val).strip() == '':
+                return None
+            return int(float(val))
+        except (TypeError, ValueError):
+            return None
+
+    def _diff_expenses(self, df, baseline=None):
+        """Compare `df` to `baseline` (a snapshot frame, default: the last loaded snapshot).
+
+        Returns (inserts, updates, deleted_ids) where inserts are records without
+        an id and updates are records that include their id. The comparison runs
+        column-wise over the normalized frames.
+        """
+        snapshot = self._expenses_snapshot if baseline is None else baseline
+        frame = normalize_expenses(df)
+        ids = parse_ids(df['id']) if 'id' in df.columns else pd.Series(float('nan'), index=df.index)
+        # Rows without a known id, and repeats of an id, are new rows
+        known = (ids.notna() & ids.isin(snapshot.index) & ~ids.duplicated()).to_numpy()
+        inserts = frame_records(frame[~known])
+
+        current = frame[known]
+        current.index = pd.Index(ids[known].astype('int64'), name='id')
+        changed = current.ne(snapshot.loc[current.index, EXPENSE_DB_COLUMNS]).any(axis=1)
+        updates = [
+            {'id': row_id, **record}
+            for row_id, record in zip(current.index[changed].tolist(), frame_records(current[changed]))
+        ]
+        deleted_ids = snapshot.index[~snapshot.index.isin(current.index)].tolist()
+        return inserts, updates, deleted_ids
+
+    def _apply_expense_changes(self, inserts, updates, deleted_ids):
+        """Send a computed diff to Supabase and keep the snapshot in sync."""
+        url = f"{self.base_url}/rest/v1/expenses"
+        id_chunk_size = 200  # keep DELETE URLs well below gateway limits
+
+        # 1. Deletions - one DELETE per id list
+        for i in range(0, len(deleted_ids), id_chunk_size):
+            ids = deleted_ids[i:i + id_chunk_size]
+            id_list = ','.join(str(row_id) for row_id in ids)
+            response = self._request_with_retry(self.session.delete, f"{url}?id=in.({id_list})")
+            self._ensure_ok(response, "מחיקת הוצאות")
+            self._snapshot_drop(ids)
+
+        # 2. Updates - PATCH a single row, bulk upsert for many
+        if len(updates) == 1:
+            record = dict(updates[0])
+            row_id = record.pop('id')
+            response = self._request_with_retry(self.session.patch, f"{url}?id=eq.{row_id}", json=record)
+            self._ensure_ok(response, "עדכון הוצאה")
+            self._snapshot_put(pd.DataFrame([record], index=pd.Index([row_id], name='id')))
+        elif updates:
+            upsert_headers = {**self.headers, "Prefer": "resolution=merge-duplicates,return=minimal"}
+            report = self._bulk_post(f"{url}?on_conflict=id", updates, headers=upsert_headers, idempotent=True)
+            for entry in report:
+                if entry['ok']:
+                    sent = pd.DataFrame(updates[entry['start']:entry['start'] + entry['rows']])
+                    self._snapshot_put(sent.set_index('id'))
+            self._ensure_uploaded(report, "עדכון הוצאות")
+
+        # 3. Inserts - bulk POST, reading back the new ids for the snapshot
+        if inserts:
+            self._ensure_uploaded(self._insert_expenses(inserts), "הוספת הוצאות")
+
+    def _insert_expenses(self, records):
+        """Bulk POST new expense records; returns the per-chunk upload report.
+
+        Rows of chunks that succeeded are added to the snapshot with their new ids.
+        """
+        insert_headers = {**self.headers, "Prefer": "return=representation"}
+        select = ','.join(['id'] + EXPENSE_DB_COLUMNS)
+        report = self._bulk_post(
+            f"{self.base_url}/rest/v1/expenses?select={select}", records, headers=insert_headers
+        )
+        for entry in report:
+            if entry['ok']:
+                self._snapshot_put(self._records_from_db(entry['response'].json()))
+        return report
+
+    def _bulk_post(self, url, rows, headers=None, serialize=None, **upload_options):
+        """POST `rows` through the pipelined uploader; returns its per-chunk report.
+
+        Pass `idempotent=True` for upserts; plain inserts are not replayed after
+        a timeout or 5xx, since the rows may already have been written.
+        """
+        headers = headers or self.headers
+        upload_options.setdefault('max_in_flight', self.upload_in_flight)
+
+        def send(records):
+            # No _request_with_retry here - upload_chunks owns the retries
+            kwargs = {'json': records, 'headers': headers, 'timeout': REQUEST_TIMEOUT}
+            self._compress_body(kwargs)
+            return self.session.post(url, **kwargs)
+
+        report = upload_chunks(send, rows, serialize=serialize, **upload_options)
+        self.last_upload_report = report
+        return report
+
+    @staticmethod
+    def _ensure_uploaded(report, action):
+        """Raise if any chunk of an upload report failed."""
+        failed = failed_chunks(report)
+        if failed:
+            status = failed[0]['status'] or 'No response'
+            raise SupabaseRequestError(
+                f"בקשת {action} נכשלה ב-{len(failed)} מתוך {len(report)} מנות (סטטוס: {status})", status
+            )
+
+    @staticmethod
+    def _ensure_ok(response, action):
+        if response is None or response.status_code not in (200, 201, 204):
+            status = response.status_code if response is not None else 'No response'
+            raise SupabaseRequestError(f"בקשת {action} נכשלה (סטטוס: {status})", status)
+
+    def update_expense_category(self, expense_id, category):
+        """Set the category of a single expense with one PATCH."""
+        if self.connected:
+            try:
+                row_id = self._parse_id(expense_id)
+                with self._expenses_lock:
+                    response = self._request_with_retry(
+                        self.session.patch, f"{self.base_url}/rest/v1/expenses?id=eq.{row_id}",
+                        json={'category': category}
+                    )
+                    self._ensure_ok(response, "עדכון הוצאה")
+                    if self._expenses_snapshot is not None and row_id in self._expenses_snapshot.index:
+                        self._expenses_snapshot.loc[row_id, 'category'] = category
             except Exception as e:
-                st.warning(f"⚠️ שגיאה בשמירת הוצאות: {e}")
-        self._save_local_expenses(df)
+                st.warning(f"⚠️ שגיאה בעדכון הוצאה: {e}")
+            return
+        row_id = self._parse_id(expense_id)
+        if row_id is not None:
+            self.storage.update_category([row_id], category)
+
+    def classify_business(self, business, category):
+        """Categorize every uncategorized expense of `business` with one PATCH.
+
+        Returns the number of rows updated.
+        """
+        if self.connected:
+            try:
+                params = _where_params({'business': f"eq.{business}", **UNCATEGORIZED_FILTER})
+                headers = {**self.headers, "Prefer": "return=representation"}
+                with self._expenses_lock:
+                    response = self._request_with_retry(
+                        self.session.patch, f"{self.base_url}/rest/v1/expenses?select=id&{params}",
+                        json={'category': category}, headers=headers
+                    )
+                    self._ensure_ok(response, "עדכון הוצאות")
+                    updated_ids = [self._parse_id(item.get('id')) for item in response.json()]
+                    if self._expenses_snapshot is not None:
+                        snapshot = self._expenses_snapshot
+                        snapshot.loc[snapshot.index.isin(updated_ids), 'category'] = category
+                return len(updated_ids)
+            except Exception as e:
+                st.warning(f"⚠️ שגיאה בעדכון הוצאות: {e}")
+                return 0
+        return self.storage.classify_business(business, category)
+
+    # --- DASHBOARD AGGREGATES ---
+    def _fetch_view(self, view, order):
+        """Read a small (aggregate) view in full; views have no id to keyset on."""
+        url = f"{self.base_url}/rest/v1/{view}?select=*&order={order}"
+        rows = []
+        while True:
+            response = self._request_with_retry(self.session.get, f"{url}&limit={PAGE_SIZE}&offset={len(rows)}")
+            self._ensure_ok(response, "טעינת סיכומים")
+            page = response.json()
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+
+    def _load_summary(self, by):
+        key_col = SUMMARY_COLUMNS[by]
+        if self.connected:
+            try:
+                rows = self._fetch_view(f"expenses_{by}ly_summary", f"{key_col},category")
+                df = pd.DataFrame(rows, columns=[key_col, 'category', 'total', 'count'])
+                df = df.rename(columns={'category': 'קטגוריה'})
+                df['קטגוריה'] = df['קטגוריה'].fillna('')
+                df['total'] = pd.to_numeric(df['total'], errors='coerce').fillna(0.0)
+                df['count'] = df['count'].astype(int)
+                if by == 'month':
+                    df[key_col] = pd.to_datetime(df[key_col])
+                else:
+                    df[key_col] = df[key_col].astype(int)
+                return df, True
+            except Exception as e:
+                # Views not created yet - aggregate the full table instead
+                print(f"[WARN] Summary view unavailable, aggregating locally: {e}")
+                expenses, ok = self.load_expenses()
+                return _summarize_expenses(expenses, by), ok
+        df = self.storage.summarize(by).rename(columns={'category': 'קטגוריה'})
+        df['total'] = df['total'].astype(float)
+        df['count'] = df['count'].astype(int)
+        df[key_col] = pd.to_datetime(df[key_col]) if by == 'month' else df[key_col].astype(int)
+        return df, False
+
+    def load_monthly_summary(self):
+        """Totals and counts per month x category (view expenses_monthly_summary); returns (df, ok)."""
+        return self._load_summary('month')
+
+    def load_yearly_summary(self):
+        """Totals and counts per year x category (view expenses_yearly_summary); returns (df, ok)."""
+        return self._load_summary('year')
 
     # --- CATEGORIES ---
     def load_categories(self):
+        """Returns (categories, ok); `ok` is False after a local fallback."""
         if self.connected:
             for attempt in range(MAX_RETRIES):
                 try:
-                    url = f"{self.base_url}/rest/v1/categories?select=name"
-                    all_data = []
-                    offset = 0
-                    limit = 1000
-                    
-                    while True:
-                        paged_url = f"{url}&limit={limit}&offset={offset}"
-                        response = self._request_with_retry(requests.get, paged_url)
-                        if response is not None and response.status_code == 200:
-                            data = response.json()
-                            if not data:
-                                break
-                            all_data.extend(data)
-                            if len(data) < limit:
-                                break
-                            offset += limit
-                        else:
-                            break
+                    all_data = self._fetch_all_rows('categories', select='id,name')
                     
                     if all_data:
-                        return [item['name'] for item in all_data]
-                    return self._load_local_categories()
+                        return [item['name'] for item in all_data], True
+                    return self._load_local_categories(), True
                 except Exception as e:
                     if attempt < MAX_RETRIES - 1:
                         time.sleep(RETRY_DELAY * (attempt + 1))
                         continue
                     st.warning(f"⚠️ לא ניתן לטעון קטגוריות מהשרת: {e}")
                     break
-        return self._load_local_categories()
+        return self._load_local_categories(), False
 
     def save_categories(self, categories_list):
         if self.connected:
             try:
                 url = f"{self.base_url}/rest/v1/categories"
-                self._request_with_retry(requests.delete, f"{url}?name=neq.PLACEHOLDER")
+                self._request_with_retry(self.session.delete, f"{url}?name=neq.PLACEHOLDER")
                 
                 data = [{'name': c} for c in categories_list]
-                self._request_with_retry(requests.post, url, json=data)
-                return
+                self._request_with_retry(self.session.post, url, json=data)
             except Exception as e:
                 st.warning(f"⚠️ שגיאה בשמירת קטגוריות: {e}")
+            return
         self._save_local_categories(categories_list)
 
     # --- MAPPING ---
     def load_mapping(self):
+        """Returns (mapping, ok); `ok` is False after a local fallback."""
         if self.connected:
             for attempt in range(MAX_RETRIES):
                 try:
-                    url = f"{self.base_url}/rest/v1/mapping?select=*"
-                    all_data = []
-                    offset = 0
-                    limit = 1000
-                    
-                    while True:
-                        paged_url = f"{url}&limit={limit}&offset={offset}"
-                        response = self._request_with_retry(requests.get, paged_url)
-                        if response is not None and response.status_code == 200:
-                            data = response.json()
-                            if not data:
-                                break
-                            all_data.extend(data)
-                            if len(data) < limit:
-                                break
-                            offset += limit
-                        else:
-                            break
+                    all_data = self._fetch_all_rows('mapping')
+                    if not all_data:
+                        self._mapping_snapshot = {}
 
                     if all_data:
                         mapping = {}
@@ -290,78 +1057,111 @@ class SupabaseConnector:
                             c = str(r.get('category', '')).strip()
                             if b and c:
                                 mapping[b] = c
-                        return mapping
-                    return self._load_local_mapping()
+                        self._mapping_snapshot = dict(mapping)
+                        return mapping, True
+                    return self._load_local_mapping(), True
                 except Exception as e:
                     if attempt < MAX_RETRIES - 1:
                         time.sleep(RETRY_DELAY * (attempt + 1))
                         continue
                     st.warning(f"⚠️ לא ניתן לטעון מיפויים מהשרת: {e}")
                     break
-        return self._load_local_mapping()
+        return self._load_local_mapping(), False
+
+    def upsert_mapping_rule(self, business, category):
+        """Add or overwrite a single business -> category rule with one upsert."""
+        if self.connected:
+            try:
+                upsert_headers = {**self.headers, "Prefer": "resolution=merge-duplicates,return=minimal"}
+                response = self._request_with_retry(
+                    self.session.post, f"{self.base_url}/rest/v1/mapping?on_conflict=business",
+                    json=[{'business': business, 'category': category}], headers=upsert_headers
+                )
+                self._ensure_ok(response, "עדכון מיפוי")
+                if self._mapping_snapshot is not None:
+                    self._mapping_snapshot[business] = category
+            except Exception as e:
+                st.warning(f"⚠️ שגיאה בשמירת מיפוי: {e}")
+            return
+        self.storage.upsert_mapping_rule(business, category)
 
     def save_mapping(self, mapping_dict):
+        """Persist `mapping_dict` by sending only the rules that changed.
+
+        Added or changed rules go out as one upsert (on_conflict=business);
+        rules missing from `mapping_dict` are removed with a batched delete.
+        """
         if self.connected:
             try:
-                url = f"{self.base_url}/rest/v1/mapping"
-                self._request_with_retry(requests.delete, f"{url}?business=neq.PLACEHOLDER")
-                
-                data = [{'business': k, 'category': v} for k, v in mapping_dict.items()]
-                
-                chunk_size = 1000
-                for i in range(0, len(data), chunk_size):
-                    chunk = data[i:i + chunk_size]
-                    self._request_with_retry(requests.post, url, json=chunk)
-                return
+                if self._mapping_snapshot is None:
+                    # Nothing to diff against yet - fetch the current server state
+                    self.load_mapping()
+                if self._mapping_snapshot is None:
+                    raise SupabaseRequestError("טעינת המיפויים מהשרת נכשלה", None)
+                self._apply_mapping_changes(mapping_dict)
             except Exception as e:
+                self._mapping_snapshot = None
                 st.warning(f"⚠️ שגיאה בשמירת מיפויים: {e}")
+            return
         self._save_local_mapping(mapping_dict)
 
+    def _apply_mapping_changes(self, mapping_dict):
+        url = f"{self.base_url}/rest/v1/mapping"
+        snapshot = self._mapping_snapshot
+        changed = [{'business': k, 'category': v} for k, v in mapping_dict.items() if snapshot.get(k) != v]
+        removed = [k for k in snapshot if k not in mapping_dict]
+
+        if changed:
+            upsert_headers = {**self.headers, "Prefer": "resolution=merge-duplicates,return=minimal"}
+            report = self._bulk_post(f"{url}?on_conflict=business", changed, headers=upsert_headers, idempotent=True)
+            for entry in report:
+                if entry['ok']:
+                    for rule in changed[entry['start']:entry['start'] + entry['rows']]:
+                        snapshot[rule['business']] = rule['category']
+            self._ensure_uploaded(report, "עדכון מיפויים")
+
+        # Chunked by encoded length - a Hebrew name is ~6 URL bytes per character
+        for names, name_filter in in_filter_chunks(removed):
+            response = self._request_with_retry(self.session.delete, f"{url}?business={name_filter}")
+            self._ensure_ok(response, "מחיקת מיפויים")
+            for name in names:
+                snapshot.pop(name, None)
 
-    # --- LOCAL FALLBACKS ---
+    # --- LOCAL FALLBACKS (self.storage) ---
     def _load_local_expenses(self):
-        try:
-            df = pd.read_csv(EXPENSES_FILE, encoding='utf-8-sig')
-            for col in COLUMNS:
-                if col not in df.columns:
-                    df[col] = ''
-            return df[COLUMNS]
-        except FileNotFoundError:
-            return pd.DataFrame(columns=COLUMNS)
+        df = self.storage.load_expenses().rename(columns=EXPENSE_DB_TO_DISPLAY)
+        return apply_expense_schema(df[COLUMNS + ['id']])
 
     def _save_local_expenses(self, df):
-        df.to_csv(EXPENSES_FILE, index=False, encoding='utf-8-sig')
+        """Make the local table equal to `df`, writing only the rows that differ."""
+        baseline = expenses_by_id(self._load_local_expenses())
+        self.storage.apply_expense_changes(*self._diff_expenses(df, baseline))
+
+    def clear_local_expenses(self):
+        """Delete every expense from the local store (Supabase is not touched)."""
+        self._save_local_expenses(pd.DataFrame(columns=COLUMNS + ['id']))
+
+    def _save_local_changes(self, original_df, edited_df):
+        baseline = expenses_by_id(original_df)
+        self.storage.apply_expense_changes(*self._diff_expenses(edited_df, baseline))
 
     def _load_local_categories(self):
-        if os.path.exists(CATEGORIES_FILE):
-            try:
-                with open(CATEGORIES_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                pass
-        return DEFAULT_CATEGORIES
+        return self.storage.load_categories() or DEFAULT_CATEGORIES
 
     def _save_local_categories(self, categories_list):
-        with open(CATEGORIES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(categories_list, f, ensure_ascii=False, indent=2)
+        self.storage.save_categories(categories_list)
 
     def _load_local_mapping(self):
-        if os.path.exists(MAPPING_FILE):
-            try:
-                with open(MAPPING_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                pass
-        return {}
+        return self.storage.load_mapping()
 
     def _save_local_mapping(self, mapping_dict):
-        with open(MAPPING_FILE, 'w', encoding='utf-8') as f:
-            json.dump(mapping_dict, f, ensure_ascii=False, indent=2)
+        self.storage.save_mapping(mapping_dict)
 
 
 # Initialize Global Connector
 # NOTE: Removed @st.cache_resource because it can cache failed/None states
 # and cause persistent "no data" issues after Streamlit Cloud wake-up.
+# Loaded data is cached below by _DataCache, which skips failed loads.
 def _get_connector():
     try:
         return SupabaseConnector()
@@ -372,33 +1172,202 @@ def _get_connector():
 db = _get_connector()
 
 
+# ============================================
+# SHARED DATA CACHE
+# ============================================
+CACHE_TTL = 300  # seconds before a cached table is reloaded anyway
+
+class _DataCache:
+    """Process-wide cache of loaded tables, shared by every session.
+
+    Entries are keyed by (table, variant) - the variant distinguishes projected
+    or filtered reads of the same table. Each table has a version stamp that
+    is bumped on invalidation; a load that started before a write is never
+    stored, so readers can't resurrect stale data. Callers always get a copy,
+    since pages mutate what they load.
+    """
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}   # (table, variant) -> (version, stored_at, value)
+        self._versions = {}  # table -> int
+
+    def version(self, table):
+        with self._lock:
+            return self._versions.get(table, 0)
+
+    def get(self, table, variant=None):
+        with self._lock:
+            entry = self._entries.get((table, variant))
+            if entry is None:
+                return None
+            version, stored_at, value = entry
+            if version != self._versions.get(table, 0) or time.monotonic() - stored_at > self.ttl:
+                del self._entries[(table, variant)]
+                return None
+        return self._copy(value)
+
+    @classmethod
+    def _copy(cls, value):
+        if isinstance(value, tuple):
+            return tuple(cls._copy(item) for item in value)
+        return value.copy() if hasattr(value, 'copy') else value
+
+    def put(self, table, variant, version, value):
+        with self._lock:
+            if self._versions.get(table, 0) == version:
+                self._entries[(table, variant)] = (version, time.monotonic(), self._copy(value))
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            self._entries = {k: v for k, v in self._entries.items() if k[0] not in tables}
+
+_cache = _DataCache()
+
+def _cached_load(table, loader, variant=None):
+    """Serve `table` from the shared cache, loading (and caching) it on a miss.
+
+    `loader` returns (value, ok). Only results that came from Supabase
+    (`ok`) are cached - a local fallback after a failed request is returned
+    but never stored.
+    """
+    value = _cache.get(table, variant)
+    if value is not None:
+        return value
+    version = _cache.version(table)
+    value, ok = loader()
+    if ok:
+        _cache.put(table, variant, version, value)
+    return value
+
+def invalidate_cache(*keys):
+    """Drop cached tables (all of them if no key is given)."""
+    _cache.invalidate(*(keys or ('expenses', 'categories', 'mapping')))
+
+
 # ============================================
 # DATA ACCESS FUNCTIONS (WRAPPERS)
 # ============================================
 def load_categories():
     if db is None:
         return []
-    return db.load_categories()
+    return _cached_load('categories', db.load_categories)
 
 def save_categories(categories_list):
     if db is None:
         return
     db.save_categories(categories_list)
+    _cache.invalidate('categories')
 
 def load_mapping():
     if db is None:
         return {}
-    return db.load_mapping()
+    return _cached_load('mapping', db.load_mapping)
 
 def save_mapping(mapping_dict):
     if db is None:
         return
     db.save_mapping(mapping_dict)
+    _cache.invalidate('mapping')
+
+def load_expenses(columns=None, where=None) -> pd.DataFrame:
+    """Load expenses, optionally projected to `columns` and filtered by `where`.
+
+    `where` maps a column (Hebrew or DB name) to a PostgREST filter such as
+    'eq.סופר', 'in.(a,b)' or 'is.null'; the key 'or' takes a PostgREST
+    or-list, e.g. UNCATEGORIZED_FILTER.
+    """
+    if db is None:
+        return pd.DataFrame(columns=list(columns) if columns else COLUMNS)
+    if columns is None and not where:
+        return _cached_load('expenses', db.load_expenses)
+    variant = (tuple(columns) if columns else None, tuple(sorted((where or {}).items())))
+    return _cached_load('expenses', lambda: db.load_expenses(columns=columns, where=where), variant)
+
+def load_all(columns=None, where=None):
+    """Load expenses, categories and mapping concurrently.
+
+    Returns (expenses_df, categories, mapping); `columns`/`where` are passed to
+    `load_expenses`. Page start-up then waits for one round-trip, not three.
+    """
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+    def run(loader):
+        # Keep st.* calls (e.g. warnings) in worker threads attached to the page
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return loader()
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        expenses = pool.submit(run, lambda: load_expenses(columns=columns, where=where))
+        categories = pool.submit(run, load_categories)
+        mapping = pool.submit(run, load_mapping)
+        return expenses.result(), categories.result(), mapping.result()
+
+def query_expenses(where=None, order='date.desc,id.desc', limit=100, offset=0):
+    """One filtered, sorted page of expenses: returns (df, total_matching_rows)."""
+    if db is None:
+        return pd.DataFrame(columns=COLUMNS), 0
+    variant = ('query', tuple(sorted((where or {}).items())), order, limit, offset)
+    return _cached_load('expenses', lambda: db.query_expenses(where, order, limit, offset), variant)
+
+def save_expense_changes(original_df: pd.DataFrame, edited_df: pd.DataFrame) -> None:
+    """Persist the edits made to a subset of the expenses (see SupabaseConnector)."""
+    if db is None:
+        return
+    db.save_expense_changes(original_df, edited_df)
+    _cache.invalidate('expenses')
+
+def in_filter(values):
+    """PostgREST `in.(...)` filter for a list of values (quoted for commas etc.)."""
+    quoted = ['"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values]
+    return f"in.({','.join(quoted)})"
+
+def month_filter(months):
+    """`where` entry selecting the 'MM/YYYY' `months` by purchase-date range.
+
+    Matches the month grouping of the summary views, which use the date and
+    not the stored `month` column.
+    """
+    ranges = []
+    for month in months:
+        start = datetime.strptime(month, '%m/%Y')
+        end = (start + timedelta(days=32)).replace(day=1)
+        ranges.append(f"and(date.gte.{start:%Y-%m-%d},date.lt.{end:%Y-%m-%d})")
+    return {'or': f"({','.join(ranges)})"}
+
+def in_filter_chunks(values, max_bytes=FILTER_MAX_BYTES):
+    """Split `values` into URL-encoded `in_filter`s of at most `max_bytes` each.
+
+    Yields (chunk, encoded_filter). A value longer than `max_bytes` on its
+    own still gets a chunk of its own.
+    """
+    overhead = len(quote(in_filter([]), safe=''))
+    separator = len(quote(',', safe=''))
+    chunk, size = [], overhead
+    for value in values:
+        value_size = len(quote(in_filter([value]), safe='')) - overhead
+        if chunk and size + separator + value_size > max_bytes:
+            yield chunk, quote(in_filter(chunk), safe='')
+            chunk, size = [], overhead
+        size += value_size + (separator if chunk else 0)
+        chunk.append(value)
+    if chunk:
+        yield chunk, quote(in_filter(chunk), safe='')
+
+def load_monthly_summary() -> pd.DataFrame:
+    """[month_start, קטגוריה, total, count] - one row per month and category."""
+    if db is None:
+        return _summarize_expenses(pd.DataFrame(columns=COLUMNS), 'month')
+    return _cached_load('expenses', db.load_monthly_summary, 'monthly_summary')
 
-def load_expenses() -> pd.DataFrame:
+def load_yearly_summary() -> pd.DataFrame:
+    """[year, קטגוריה, total, count] - one row per year and category."""
     if db is None:
-        return pd.DataFrame(columns=COLUMNS)
-    return db.load_expenses()
+        return _summarize_expenses(pd.DataFrame(columns=COLUMNS), 'year')
+    return _cached_load('expenses', db.load_yearly_summary, 'yearly_summary')
 
 def get_connection_status():
     """Return connection status info for diagnostics."""
@@ -418,6 +1387,71 @@ def save_expenses(df: pd.DataFrame) -> None:
     if db is None:
         return
     db.save_expenses(df)
+    _cache.invalidate('expenses')
+
+def clear_local_expenses() -> None:
+    """Delete all locally stored (offline) expenses; Supabase data is kept."""
+    if db is None:
+        return
+    db.clear_local_expenses()
+    _cache.invalidate('expenses')
+
+def append_expenses(df: pd.DataFrame):
+    """Insert the rows of `df` as new expenses, leaving stored rows untouched.
+
+    Returns (stored, error) - see SupabaseConnector.append_expenses.
+    """
+    if db is None:
+        return [False] * len(df), "אין חיבור למסד הנתונים"
+    if df.empty:
+        return [], None
+    stored, error = db.append_expenses(df)
+    _cache.invalidate('expenses')
+    return stored, error
+
+def update_expense_category(expense_id, category: str) -> None:
+    """Categorize one expense (by id) without rewriting anything else."""
+    if db is None:
+        return
+    db.update_expense_category(expense_id, category)
+    _cache.invalidate('expenses')
+
+def classify_business(business: str, category: str) -> int:
+    """Categorize all uncategorized expenses of a business; returns rows updated."""
+    if db is None:
+        return 0
+    updated = db.classify_business(business, category)
+    _cache.invalidate('expenses')
+    return updated
+
+def upsert_mapping_rule(business: str, category: str) -> None:
+    """Learn/overwrite the default category of one business."""
+    if db is None:
+        return
+    db.upsert_mapping_rule(business, category)
+    _cache.invalidate('mapping')
+
+def replace_expenses_atomic(df: pd.DataFrame):
+    """Replace the entire expenses table in one transaction (staged upload + RPC).
+
+    Returns the per-chunk upload report (None when saved locally or on failure).
+    """
+    if db is None:
+        return None
+    report = db.replace_expenses_atomic(df)
+    _cache.invalidate('expenses')
+    return report
+
+def rebuild_expenses(df: pd.DataFrame):
+    """Rewrite the entire expenses table. Prefer `save_expenses` for edits.
+
+    Returns the per-chunk upload report (None when saved locally or on failure).
+    """
+    if db is None:
+        return None
+    report = db.rebuild_expenses(df)
+    _cache.invalidate('expenses')
+    return report
 
 
 def format_currency(amount: float) -> str:
@@ -431,214 +1465,55 @@ def get_current_month_str() -> str:
 
 def normalize_uploaded_file(uploaded_file) -> pd.DataFrame:
     """Read and normalize uploaded file to match main structure."""
-    
-    filename = uploaded_file.name.lower()
-    all_records = []
-    
-    known_date_cols = ['תאריך רכישה', 'תאריך', 'תאריך עסקה']
-    known_name_cols = ['שם בית עסק', 'שם בית העסק', 'עסק', 'שם העסק']
-    known_amount_cols = ['סכום חיוב', 'סכום עסקה', 'סכום', 'סכום מקורי']
-    summary_patterns = ['TOTAL FOR DATE', 'סך חיוב', 'סה"כ', 'סהכ', 'total']
-    
-    # Read file
-    if filename.endswith('.csv'):
-        try:
-            df_raw = pd.read_csv(uploaded_file, encoding='utf-8-sig', header=None)
-        except:
-            uploaded_file.seek(0)
-            df_raw = pd.read_csv(uploaded_file, encoding='utf-8', header=None)
-    elif filename.endswith(('.xlsx', '.xls')):
-        try:
-            uploaded_file.seek(0)
-            df_raw = pd.read_excel(uploaded_file, engine='openpyxl', header=None)
-        except:
-            try:
-                uploaded_file.seek(0)
-                df_raw = pd.read_excel(uploaded_file, engine='xlrd', header=None)
-            except Exception as e:
-                st.error(f"שגיאה בקריאת קובץ Excel: {str(e)}")
-                return pd.DataFrame()
-    else:
-        st.error("סוג קובץ לא נתמך. אנא העלה קובץ CSV או Excel.")
+    try:
+        return normalize_statement(uploaded_file, sheet_workers=PARSE_WORKERS)
+    except StatementError as e:
+        st.error(str(e))
         return pd.DataFrame()
-    
-    df_str = df_raw.astype(str)
-    header_sections = []
-    
-    # Identify header rows by searching for known column names
-    for row_idx in range(len(df_str)):
-        row_values = df_str.iloc[row_idx].tolist()
-        date_col = None
-        name_col = None
-        amount_col = None
-        
-        for col_idx, val in enumerate(row_values):
-            val_clean = str(val).strip()
-            if val_clean in known_date_cols:
-                date_col = col_idx
-            elif val_clean in known_name_cols:
-                name_col = col_idx
-            elif val_clean in known_amount_cols:
-                amount_col = col_idx
-        
-        if date_col is not None and (name_col is not None or amount_col is not None):
-            header_sections.append({
-                'row': row_idx,
-                'date_col': date_col,
-                'name_col': name_col,
-                'amount_col': amount_col
-            })
-    
-    # Process sections
-    for i, section in enumerate(header_sections):
-        if i + 1 < len(header_sections):
-            end_row = header_sections[i + 1]['row']
-        else:
-            end_row = len(df_raw)
-        
-        for row_idx in range(section['row'] + 1, end_row):
-            row = df_raw.iloc[row_idx]
-            
-            date_val = row.iloc[section['date_col']] if section['date_col'] is not None else None
-            name_val = row.iloc[section['name_col']] if section['name_col'] is not None else None
-            amount_val = row.iloc[section['amount_col']] if section['amount_col'] is not None else None
-            
-            date_str = str(date_val).strip() if pd.notna(date_val) else ''
-            name_str = str(name_val).strip() if pd.notna(name_val) else ''
-            
-            # Skip invalid rows
-            if not date_str or date_str == 'nan' or not name_str or name_str == 'nan':
-                continue
-            
-            # Skip summary rows
-            if any(pattern.lower() in name_str.lower() for pattern in summary_patterns):
-                continue
-            
-            # Parse amount
-            try:
-                amount_num = pd.to_numeric(amount_val, errors='coerce')
-                if pd.isna(amount_num) or amount_num == 0:
-                    continue
-            except:
-                continue
-            
-            all_records.append({
-                'תאריך רכישה': date_str,
-                'שם בית עסק': name_str,
-                'סכום עסקה': amount_num,
-                'חודש': '',
-                'קטגוריה': '',
-                'הערות': ''
-            })
-    
-    if not all_records:
-        return pd.DataFrame(columns=COLUMNS)
-    
-    normalized = pd.DataFrame(all_records, columns=COLUMNS)
-    
-    # Date processing
-    def parse_date(date_val):
-        if pd.isna(date_val):
-            return None
-        
-        date_str = str(date_val).strip()
-        formats_to_try = [
-            '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y',
-            '%Y-%m-%d', '%d/%m/%y', '%d-%m-%y',
-        ]
-        
-        for fmt in formats_to_try:
-            try:
-                return datetime.strptime(date_str, fmt)
-            except ValueError:
-                continue
-        try:
-            return pd.to_datetime(date_str, dayfirst=True)
-        except:
-            return None
-    
-    if len(normalized) > 0:
-        parsed_dates = normalized['תאריך רכישה'].apply(parse_date)
-        normalized['תאריך רכישה'] = parsed_dates.apply(lambda x: x.strftime('%Y-%m-%d') if x else '')
-        normalized['חודש'] = parsed_dates.apply(lambda x: x.strftime('%m/%Y') if x else '')
-    
-    return normalized
 
 
-def auto_categorize_expenses(new_df: pd.DataFrame, existing_df: pd.DataFrame) -> pd.DataFrame:
-    """Auto-categorize new entries based on existing business names."""
-    if existing_df.empty:
-        return new_df
-    
-    business_category_map = {}
-    # Prioritize most recent categorizations
-    existing_sorted = existing_df.sort_values('תאריך רכישה', ascending=True)
-    
-    for _, row in existing_sorted.iterrows():
-        business_name = str(row['שם בית עסק']).strip()
-        category = str(row['קטגוריה']).strip()
-        
-        if business_name and category:
-            business_category_map[business_name] = category
-    
-    def assign_category(row):
-        if row['קטגוריה']:
-            return row['קטגוריה']
-        business_name = str(row['שם בית עסק']).strip()
-        return business_category_map.get(business_name, '')
-    
-    new_df['קטגוריה'] = new_df.apply(assign_category, axis=1)
-    return new_df
+def iter_uploaded_batches(uploaded_file):
+    """Normalized batches of an upload (CSV chunks / Excel sheets); read errors are shown, not raised."""
+    try:
+        yield from iter_statement_batches(uploaded_file, sheet_workers=PARSE_WORKERS)
+    except StatementError as e:
+        st.error(str(e))
 
 
-# ============================================
-# CSS INJECTION
-# ============================================
+def parse_uploaded_files(uploaded_files):
+    """Parse several uploads in parallel worker processes: [{name, rows, error}] in upload order."""
+    return parse_statements([(f.name, f.getvalue()) for f in uploaded_files])
 
-def get_latest_active_month(df, min_transactions=20):
-    """
-    Get the latest month that has at least `min_transactions`.
-    Fallback to the actual last month in data if none meet criteria.
-    If no data, return current month.
-    """
-    if df.empty or 'חודש' not in df.columns:
-        return datetime.now().strftime('%m/%Y')
-        
-    # Count per month
-    counts = df['חודש'].value_counts()
-    
-    # Filter months with enough transactions
-    active_months = counts[counts >= min_transactions].index.tolist()
-    
-    def parse_month(m):
-        try:
-            return datetime.strptime(m, '%m/%Y')
-        except:
-            return datetime.min
 
-    if not active_months:
-        # Fallback to absolute last month in data (based on date column)
-        if 'תאריך רכישה' in df.columns:
-            try:
-                # Convert to datetime to find max
-                temp_dates = pd.to_datetime(df['תאריך רכישה'], format='%Y-%m-%d', errors='coerce')
-                latest_date = temp_dates.max()
-                if pd.notna(latest_date):
-                    return latest_date.strftime('%m/%Y')
-            except:
-                pass
+def auto_categorize_expenses(new_df: pd.DataFrame, existing_df) -> pd.DataFrame:
+    """Auto-categorize new entries based on existing business names.
+
+    `existing_df` is either the stored expenses or a {business: category} mapping.
+    """
+    if isinstance(existing_df, dict):
+        business_category_map = existing_df
+    else:
+        if existing_df.empty:
+            return new_df
         
-        # Fallback to sorting 'Month' strings if date column fails
-        all_months = df['חודש'].unique().tolist()
-        if all_months:
-             sorted_all = sorted(all_months, key=parse_month, reverse=True)
-             return sorted_all[0]
-             
-        return datetime.now().strftime('%m/%Y')
+        business_category_map = {}
+        # Prioritize most recent categorizations
+        existing_sorted = existing_df.sort_values('תאריך רכישה', ascending=True)
         
-    # Sort active months to get the latest one
-    sorted_active = sorted(active_months, key=parse_month, reverse=True)
-    return sorted_active[0]
+        for _, row in existing_sorted.iterrows():
+            business_name = str(row['שם בית עסק']).strip()
+            category = str(row['קטגוריה']).strip()
+            
+            if business_name and category:
+                business_category_map[business_name] = category
+    
+    if new_df.empty or not business_category_map:
+        return new_df
+    # Rows that already have a category keep it
+    mapped = new_df['שם בית עסק'].astype(str).str.strip().map(business_category_map).fillna('')
+    current = new_df['קטגוריה']
+    new_df['קטגוריה'] = current.where(current.astype(bool), mapped)
+    return new_df
 
 
 # ============================================